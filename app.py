@@ -1,24 +1,39 @@
 # app.py - Main application file using SQLite for reliability
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, render_template_string, make_response
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, make_response, Response, stream_with_context, g, has_request_context, abort
 from flask_sqlalchemy import SQLAlchemy
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
+from socketio import PubSubManager
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.pool import NullPool
+from sqlalchemy.exc import IntegrityError
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 import json
 import os
 import qrcode
 from io import BytesIO, StringIO
-import base64
 import csv
 import secrets
 import string
-from functools import wraps
+from functools import wraps, lru_cache
 import logging
+import click
 import sys
 import traceback
 import socket
 import hashlib
+import pickle
+import threading
+import time
+import bisect
+import zlib
+import re
+import heapq
+from collections import deque, OrderedDict
+from contextlib import ExitStack
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG, 
@@ -42,11 +57,12 @@ logger.info(f"Using SECRET_KEY: {secret_key[:5]}...")
 
 # Configure database with PostgreSQL support for persistence
 DATABASE_URL = os.getenv('DATABASE_URL')
-if DATABASE_URL and DATABASE_URL.startswith('postgres://'):
+if DATABASE_URL:
     # Replace postgres:// with postgresql:// for SQLAlchemy
-    DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
+    if DATABASE_URL.startswith('postgres://'):
+        DATABASE_URL = DATABASE_URL.replace('postgres://', 'postgresql://', 1)
     app.config['SQLALCHEMY_DATABASE_URI'] = DATABASE_URL
-    logger.info("Using PostgreSQL database")
+    logger.info(f"Using {make_url(DATABASE_URL).get_backend_name()} database from DATABASE_URL")
 else:
     # Fallback to SQLite with persistent storage
     data_dir = os.path.join(os.getcwd(), 'persistent_data')
@@ -56,19 +72,195 @@ else:
     logger.info(f"Using SQLite database at: {DB_PATH}")
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-logger.info(f"Database URI: {app.config['SQLALCHEMY_DATABASE_URI']}")
+logger.info(f"Database URI: {make_url(app.config['SQLALCHEMY_DATABASE_URI']).render_as_string(hide_password=True)}")
+
+# Connection pool profile (DB_POOL_PROFILE):
+#   standard   a pool sized for many greenlets per worker: DB_POOL_SIZE connections
+#              plus DB_MAX_OVERFLOW more under bursts, checked with a ping before use
+#              and replaced after DB_POOL_RECYCLE seconds; waits at most
+#              DB_POOL_TIMEOUT seconds for a free connection instead of hanging
+#   pgbouncer  no pool in the app - every checkout opens a connection to PgBouncer
+#              (transaction pooling), which does the pooling; the app uses no
+#              session state that would break that mode
+#   stock      SQLAlchemy's defaults and no SQLite pragmas, for comparison
+# SQLite connections get WAL (readers no longer wait for a commit), synchronous=
+# NORMAL (durable across app crashes, may lose the last commits on power loss),
+# a busy timeout instead of immediate "database is locked" errors, and mmap reads.
+DB_POOL_PROFILE = os.getenv('DB_POOL_PROFILE', 'standard')
+DB_POOL_PROFILES = {
+    'standard': {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', '1') == '1'
+    },
+    'pgbouncer': {
+        'poolclass': NullPool
+    },
+    'stock': {}
+}
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+}
+
+if DB_POOL_PROFILE not in DB_POOL_PROFILES:
+    raise ValueError(f"Unknown DB_POOL_PROFILE {DB_POOL_PROFILE!r}, expected one of {', '.join(DB_POOL_PROFILES)}")
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = DB_POOL_PROFILES[DB_POOL_PROFILE]
+logger.info(f"Database pool profile: {DB_POOL_PROFILE}")
+
+# Socket.IO message queue - required when running more than one worker or node,
+# otherwise events emitted in one process never reach sockets held by another.
+# redis://, rediss://, kafka://, zmq+tcp:// and amqp:// URLs are handled by
+# python-socketio; memory:// relays between servers inside this process only.
+SOCKETIO_MESSAGE_QUEUE = os.getenv('SOCKETIO_MESSAGE_QUEUE')
+SOCKETIO_CHANNEL = os.getenv('SOCKETIO_CHANNEL', 'flask-socketio')
+
+class LocalPubSubManager(PubSubManager):
+    """In-process stand-in for a message queue backend (memory://).
+
+    Every manager subscribed to the same channel in this process receives every
+    published message, so several Socket.IO servers can run side by side as if
+    they were separate workers - useful for tests and local development.
+    """
+    name = 'memory'
+    channels = {}
+
+    def __init__(self, url='memory://', channel='flask-socketio', write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    def _publish(self, data):
+        # Pickle like a real backend would so no state is shared between servers
+        message = pickle.dumps(data)
+        for queue in self.channels.get(self.channel, []):
+            queue.put(message)
+
+    def _listen(self):
+        # Subscribes when listening starts, as the network backends do
+        queue = self.server.eio.create_queue()
+        self.channels.setdefault(self.channel, []).append(queue)
+        while True:
+            yield queue.get()
+
+socketio_options = {}
+if SOCKETIO_MESSAGE_QUEUE:
+    if SOCKETIO_MESSAGE_QUEUE.startswith('memory://'):
+        socketio_options['client_manager'] = LocalPubSubManager(SOCKETIO_MESSAGE_QUEUE, channel=SOCKETIO_CHANNEL)
+    else:
+        socketio_options['message_queue'] = SOCKETIO_MESSAGE_QUEUE
+        socketio_options['channel'] = SOCKETIO_CHANNEL
+    logger.info(f"Using Socket.IO message queue: {SOCKETIO_MESSAGE_QUEUE.split('://')[0]}://")
+
+# Metrics - kept in plain in-process counters so recording costs a few dict
+# updates per request, and rendered in the Prometheus text format by /metrics.
+# Each worker reports its own numbers; Prometheus sums them across workers
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # optional bearer token for /metrics
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency = {}        # (endpoint, method) -> [bucket counts..., sum, count]
+        self.queries = {}        # endpoint -> statements
+        self.query_seconds = {}  # endpoint -> seconds
+        self.emits = {}          # event -> count
+        self.streams = 0         # open /api/stream connections
+
+    def observe_request(self, endpoint, method, seconds, queries, query_seconds):
+        with self.lock:
+            series = self.latency.get((endpoint, method))
+            if series is None:
+                series = self.latency[(endpoint, method)] = [0] * (len(LATENCY_BUCKETS) + 3)  # buckets, +Inf, sum, count
+            series[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            series[-2] += seconds
+            series[-1] += 1
+            self.queries[endpoint] = self.queries.get(endpoint, 0) + queries
+            self.query_seconds[endpoint] = self.query_seconds.get(endpoint, 0) + query_seconds
+
+    def count_emit(self, event):
+        with self.lock:
+            self.emits[event] = self.emits.get(event, 0) + 1
+
+metrics = Metrics()
+
+# SQL profiling - development only (SQL_PROFILE=1, on by default with FLASK_DEBUG).
+# Every statement of a request is kept, grouped by shape, and the request is
+# flagged when it runs more statements than its route's budget or repeats one
+# shape N_PLUS_ONE_THRESHOLD times or more. Totals are sent back in X-Query-*
+# headers and the last SQL_PROFILE_HISTORY requests are listed at /debug/queries
+SQL_PROFILE = os.getenv('SQL_PROFILE', '1' if app.debug else '0') == '1'
+SQL_PROFILE_HISTORY = int(os.getenv('SQL_PROFILE_HISTORY', '200'))
+DEFAULT_QUERY_BUDGET = int(os.getenv('QUERY_BUDGET', '10'))
+N_PLUS_ONE_THRESHOLD = 5
+sql_profiles = deque(maxlen=SQL_PROFILE_HISTORY)
+
+def query_budget(limit):
+    # Declares how many SQL statements one request to the route may run. Put it
+    # below @login_required - wraps() carries the attribute up to the view
+    def decorator(f):
+        f.query_budget = limit
+        return f
+    return decorator
+
+def statement_shape(statement):
+    # Expanded IN lists and literals would make every request look different
+    shape = ' '.join(statement.split())
+    shape = re.sub(r"'(?:[^']|'')*'", '?', shape)
+    shape = re.sub(r'\b\d+\b', '?', shape)
+    shape = re.sub(r'(?:\?|%\(\w+\)s|%s)(?:\s*,\s*(?:\?|%\(\w+\)s|%s))+', '?', shape)
+    return shape
+
+def build_sql_profile(response):
+    statements = g.sql_statements
+    shapes = {}
+    for statement, seconds in statements:
+        shape = shapes.setdefault(statement_shape(statement), {'count': 0, 'seconds': 0.0})
+        shape['count'] += 1
+        shape['seconds'] += seconds
+    
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', DEFAULT_QUERY_BUDGET)
+    shapes = sorted(({'statement': shape, 'count': totals['count'], 'ms': round(totals['seconds'] * 1000, 3)}
+                     for shape, totals in shapes.items()), key=lambda shape: -shape['count'])
+    return {
+        'time': datetime.utcnow().isoformat(),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint or 'unmatched',
+        'status': response.status_code,
+        'queries': len(statements),
+        'query_ms': round(sum(seconds for _, seconds in statements) * 1000, 3),
+        'budget': budget,
+        'over_budget': len(statements) > budget,
+        'repeated': [shape for shape in shapes if shape['count'] >= N_PLUS_ONE_THRESHOLD],
+        'shapes': shapes
+    }
+
+def metric_labels(**labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+class InstrumentedSocketIO(SocketIO):
+    # Every emit, from routes, background tasks or socket handlers, passes here
+    def emit(self, event, *args, **kwargs):
+        metrics.count_emit(event)
+        return super().emit(event, *args, **kwargs)
 
 # Initialize extensions
 try:
     db = SQLAlchemy(app)
     logger.info("SQLAlchemy initialized successfully")
     
-    socketio = SocketIO(
+    socketio = InstrumentedSocketIO(
         app, 
         cors_allowed_origins="*", 
         async_mode='gevent',
         logger=True,
-        engineio_logger=True
+        engineio_logger=True,
+        **socketio_options
     )
     logger.info("SocketIO initialized with async_mode='gevent'")
 except Exception as e:
@@ -82,10 +274,139 @@ def handle_exception(e):
     logger.error(traceback.format_exc())
     return jsonify({"error": "Internal Server Error", "details": str(e)}), 500
 
+# Request metrics - SQL statements are attributed to the request that ran them
+@app.before_request
+def start_request_metrics():
+    g.metrics_start = time.perf_counter()
+    g.metrics_queries = 0
+    g.metrics_query_seconds = 0.0
+    if SQL_PROFILE:
+        g.sql_statements = []
+
+@app.after_request
+def record_request_metrics(response):
+    start = g.get('metrics_start')
+    if start is not None:
+        metrics.observe_request(request.endpoint or 'unmatched', request.method, time.perf_counter() - start,
+                                g.metrics_queries, g.metrics_query_seconds)
+    if SQL_PROFILE and 'sql_statements' in g and request.endpoint not in ('static', 'debug_queries'):
+        profile = build_sql_profile(response)
+        sql_profiles.append(profile)
+        response.headers['X-Query-Count'] = str(profile['queries'])
+        response.headers['X-Query-Time-Ms'] = str(profile['query_ms'])
+        response.headers['X-Query-Budget'] = str(profile['budget'])
+        if profile['over_budget']:
+            logger.warning(f"{profile['endpoint']} ran {profile['queries']} SQL statements, budget is {profile['budget']}: {profile['path']}")
+        for shape in profile['repeated']:
+            logger.warning(f"Possible N+1 in {profile['endpoint']}: {shape['count']}x {shape['statement']}")
+    return response
+
+with app.app_context():
+    if db.engine.dialect.name == 'sqlite' and DB_POOL_PROFILE != 'stock':
+        @event.listens_for(db.engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in SQLITE_PRAGMAS.items():
+                cursor.execute(f'PRAGMA {name} = {value}')
+            cursor.close()
+
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def start_query_metrics(conn, cursor, statement, parameters, context, executemany):
+        conn.info['metrics_query_start'] = time.perf_counter()
+
+    @event.listens_for(db.engine, 'after_cursor_execute')
+    def record_query_metrics(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'metrics_start' in g:
+            seconds = time.perf_counter() - conn.info['metrics_query_start']
+            g.metrics_queries += 1
+            g.metrics_query_seconds += seconds
+            if SQL_PROFILE:
+                g.sql_statements.append((statement, seconds))
+
 # Simple health check that doesn't require database
 @app.route('/api/health')
 def api_health():
-    return jsonify({"status": "API is running", "time": str(datetime.utcnow())}), 200
+    return jsonify({
+        "status": "API is running",
+        "time": str(datetime.utcnow()),
+        "queue_events": event_coalescer.stats(),
+        "metadata_cache": metadata_cache.stats()
+    }), 200
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    lines = []
+    def family(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+    
+    with metrics.lock:
+        latency = {key: list(series) for key, series in metrics.latency.items()}
+        queries = dict(metrics.queries)
+        query_seconds = dict(metrics.query_seconds)
+        emits = dict(metrics.emits)
+    
+    family('queue_http_request_duration_seconds', 'histogram', 'Request latency per Flask endpoint.')
+    for (endpoint, method), series in sorted(latency.items()):
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',), series):
+            cumulative += count
+            lines.append(f'queue_http_request_duration_seconds_bucket{metric_labels(endpoint=endpoint, method=method, le=bound)} {cumulative}')
+        lines.append(f'queue_http_request_duration_seconds_sum{metric_labels(endpoint=endpoint, method=method)} {series[-2]}')
+        lines.append(f'queue_http_request_duration_seconds_count{metric_labels(endpoint=endpoint, method=method)} {series[-1]}')
+    
+    family('queue_db_queries_total', 'counter', 'SQL statements run while handling requests, per endpoint.')
+    for endpoint, count in sorted(queries.items()):
+        lines.append(f'queue_db_queries_total{metric_labels(endpoint=endpoint)} {count}')
+    family('queue_db_query_seconds_total', 'counter', 'Time spent in SQL statements while handling requests, per endpoint.')
+    for endpoint, seconds in sorted(query_seconds.items()):
+        lines.append(f'queue_db_query_seconds_total{metric_labels(endpoint=endpoint)} {seconds}')
+    
+    rooms = socketio.server.manager.rooms.get('/', {})
+    family('queue_socketio_connected_clients', 'gauge', 'Socket.IO clients connected to this worker.')
+    lines.append(f'queue_socketio_connected_clients {len(rooms.get(None, ()))}')
+    family('queue_socketio_company_clients', 'gauge', 'Socket.IO clients in each company room on this worker.')
+    prefix = company_room('')
+    for room, members in sorted((room, members) for room, members in rooms.items() if room and room.startswith(prefix)):
+        lines.append(f'queue_socketio_company_clients{metric_labels(company=room[len(prefix):])} {len(members)}')
+    family('queue_socketio_emits_total', 'counter', 'Socket.IO events emitted, per event type.')
+    for name, count in sorted(emits.items()):
+        lines.append(f'queue_socketio_emits_total{metric_labels(event=name)} {count}')
+    
+    coalescer = event_coalescer.stats()
+    family('queue_status_streams', 'gauge', 'Open /api/stream connections on this worker.')
+    lines.append(f'queue_status_streams {metrics.streams}')
+    
+    family('queue_updates_requested_total', 'counter', 'Queue changes that asked for a push to clients.')
+    lines.append(f'queue_updates_requested_total {coalescer["requested"]}')
+    family('queue_updates_collapsed_total', 'counter', 'Queue changes merged into a later push.')
+    lines.append(f'queue_updates_collapsed_total {coalescer["collapsed"]}')
+    family('queue_updates_failed_total', 'counter', 'Queue update pushes that raised.')
+    lines.append(f'queue_updates_failed_total {coalescer["failed"]}')
+    
+    cache = metadata_cache.stats()
+    family('queue_metadata_cache_hits_total', 'counter', 'Company and cashier lookups answered from the metadata cache.')
+    lines.append(f'queue_metadata_cache_hits_total {cache["hits"]}')
+    family('queue_metadata_cache_misses_total', 'counter', 'Company and cashier lookups that went to the database.')
+    lines.append(f'queue_metadata_cache_misses_total {cache["misses"]}')
+    family('queue_metadata_cache_invalidations_total', 'counter', 'Metadata cache keys invalidated, locally or by other workers.')
+    lines.append(f'queue_metadata_cache_invalidations_total {cache["invalidations"]}')
+    family('queue_metadata_cache_entries', 'gauge', 'Entries in the metadata cache.')
+    lines.append(f'queue_metadata_cache_entries {cache["entries"]}')
+    
+    family('queue_waiting_customers', 'gauge', 'Customers waiting per cashier.')
+    serving = []
+    for queue in sorted(list(queue_engine.cashiers.values()), key=lambda queue: (queue.company_code, queue.cashier_number)):
+        labels = metric_labels(company=queue.company_code, cashier=queue.cashier_number)
+        lines.append(f'queue_waiting_customers{labels} {len(queue.tickets)}')
+        serving.append(f'queue_serving_customers{labels} {1 if queue.serving else 0}')
+    family('queue_serving_customers', 'gauge', 'Customers at the counter per cashier.')
+    lines.extend(serving)
+    
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
 
 # Models
 class Admin(db.Model):
@@ -108,6 +429,10 @@ class Company(db.Model):
     company_code = db.Column(db.String(20), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     cashiers = db.relationship('Cashier', backref='company', lazy=True, cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        db.Index('ix_company_admin', admin_id),
+    )
 
 class Cashier(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -115,6 +440,10 @@ class Cashier(db.Model):
     cashier_number = db.Column(db.Integer, nullable=False)
     is_active = db.Column(db.Boolean, default=True)
     customers = db.relationship('Customer', backref='cashier', lazy=True)
+    
+    __table_args__ = (
+        db.Index('ix_cashier_company_active', company_id, is_active),
+    )
 
 class Customer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -124,8 +453,25 @@ class Customer(db.Model):
     served_time = db.Column(db.DateTime)
     status = db.Column(db.String(20), default='waiting')  # waiting, serving, served, delayed, removed
     delays = db.Column(db.Integer, default=0)
-    position = db.Column(db.Integer, nullable=False)
+    # Ticket sequence number, increasing per cashier. Queue order is ticket order
+    # and the live position is derived from it (see CashierQueue.position), so
+    # serving or removing a customer never renumbers the rest of the queue.
+    # Stored in the old 'position' column, whose dense 1..n values are valid tickets.
+    ticket = db.Column('position', db.Integer, nullable=False)
     serving_start_time = db.Column(db.DateTime)
+    
+    __table_args__ = (
+        db.Index('ix_customer_cashier_status_position', cashier_id, status, ticket),
+        db.Index('ix_customer_otp', otp),
+        # An OTP identifies at most one customer who is still in a queue
+        db.Index('uq_customer_active_otp', otp, unique=True,
+                 postgresql_where=db.text("status IN ('waiting', 'serving')"),
+                 sqlite_where=db.text("status IN ('waiting', 'serving')")),
+        # Tickets order a cashier's queue, so no two customers still in it share one
+        db.Index('uq_customer_active_ticket', cashier_id, ticket, unique=True,
+                 postgresql_where=db.text("status IN ('waiting', 'serving')"),
+                 sqlite_where=db.text("status IN ('waiting', 'serving')")),
+    )
 
 class QueueHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -137,14 +483,902 @@ class QueueHistory(db.Model):
     wait_time_seconds = db.Column(db.Integer)
     status = db.Column(db.String(20), nullable=False)
     delays = db.Column(db.Integer, default=0)
+    
+    __table_args__ = (
+        db.Index('ix_queue_history_company_status', company_id, status),
+        db.Index('ix_queue_history_company_id', company_id, id),
+    )
+
+class CustomerArchive(db.Model):
+    # Finished customers moved out of Customer by archive_finished_customers,
+    # so the hot table only holds live queues and recent history
+    __tablename__ = 'customer_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # Customer.id
+    cashier_id = db.Column(db.Integer, nullable=False)
+    otp = db.Column(db.String(6), nullable=False)
+    join_time = db.Column(db.DateTime)
+    served_time = db.Column(db.DateTime)
+    status = db.Column(db.String(20), nullable=False)
+    delays = db.Column(db.Integer, default=0)
+    ticket = db.Column(db.Integer, nullable=False)
+    serving_start_time = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_customer_archive_otp', otp),
+    )
+
+class OtpSequence(db.Model):
+    # One row: the next counter value for OtpAllocator and its permutation key
+    __tablename__ = 'otp_sequence'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    next_value = db.Column(db.BigInteger, nullable=False)
+    key = db.Column(db.String(64), nullable=False)
+
+class ServiceTimeEstimate(db.Model):
+    # Running average of how long a cashier takes per customer, updated as
+    # customers are served so wait estimates never have to scan QueueHistory
+    cashier_id = db.Column(db.Integer, db.ForeignKey('cashier.id'), primary_key=True)
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), nullable=False)
+    avg_service_seconds = db.Column(db.Float, nullable=False)
+    samples = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class QueueStats(db.Model):
+    # Running totals of QueueHistory per cashier, updated in the same transaction
+    # that writes each history row so statistics never have to scan history.
+    # Rebuild from history with `flask --app app rebuild-stats`
+    company_id = db.Column(db.Integer, db.ForeignKey('company.id'), primary_key=True)
+    cashier_number = db.Column(db.Integer, primary_key=True)
+    served_count = db.Column(db.Integer, nullable=False, default=0)
+    removed_count = db.Column(db.Integer, nullable=False, default=0)
+    delayed_count = db.Column(db.Integer, nullable=False, default=0)  # finished with at least one delay
+    wait_seconds_total = db.Column(db.BigInteger, nullable=False, default=0)  # over served customers
+
+class SchemaVersion(db.Model):
+    __tablename__ = 'schema_version'
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Schema migrations - db.create_all() only creates missing tables and never
+# alters existing ones, so changes to existing tables are listed here and
+# applied once, in order, on startup or with `flask --app app migrate`.
+# Migrations must be safe to run against a database created by create_all().
+def create_indexes(*names):
+    def migration(connection):
+        indexes = {index.name: index for table in db.metadata.tables.values() for index in table.indexes}
+        for name in names:
+            indexes[name].create(bind=connection, checkfirst=True)
+    return migration
+
+def unique_active_tickets(connection):
+    # Joins racing before tickets were allocated under a lock could give two
+    # customers of a cashier the same position. Number the active customers of
+    # those cashiers after the cashier's last ticket, in (position, join_time)
+    # order, then enforce it
+    customer = Customer.__table__
+    active = customer.c.status.in_(['waiting', 'serving'])
+    duplicated = db.select(customer.c.cashier_id).where(active).group_by(
+        customer.c.cashier_id, customer.c.position
+    ).having(db.func.count() > 1).distinct()
+    for cashier_id in connection.execute(duplicated).scalars().all():
+        last_ticket = connection.execute(
+            db.select(db.func.max(customer.c.position)).where(customer.c.cashier_id == cashier_id)
+        ).scalar()
+        ids = connection.execute(
+            db.select(customer.c.id).where(customer.c.cashier_id == cashier_id, active)
+            .order_by(customer.c.position, customer.c.join_time, customer.c.id)
+        ).scalars().all()
+        logger.warning(f"Renumbering {len(ids)} active customers of cashier {cashier_id} with duplicate tickets")
+        connection.execute(
+            customer.update().where(customer.c.id == db.bindparam('customer_id')).values(position=db.bindparam('ticket')),
+            [{'customer_id': customer_id, 'ticket': last_ticket + number} for number, customer_id in enumerate(ids, 1)]
+        )
+    create_indexes('uq_customer_active_ticket')(connection)
+
+MIGRATIONS = [
+    (1, 'Indexes for hot queue queries and unique active OTPs',
+     create_indexes('ix_cashier_company_active', 'ix_customer_cashier_status_position', 'ix_customer_otp',
+                    'uq_customer_active_otp', 'ix_queue_history_company_status')),
+    (2, 'Index for paging through company history',
+     create_indexes('ix_queue_history_company_id')),
+    (3, 'Backfill queue statistics from history',
+     lambda connection: rebuild_queue_stats(connection)),
+    (4, 'Index for listing an admin\'s companies',
+     create_indexes('ix_company_admin')),
+    (5, 'Unique tickets among active customers of a cashier',
+     unique_active_tickets),
+]
+
+def run_migrations():
+    applied = {version for (version,) in db.session.query(SchemaVersion.version)}
+    db.session.commit()
+    
+    for version, description, migration in MIGRATIONS:
+        if version in applied:
+            continue
+        logger.info(f"Applying schema migration {version}: {description}")
+        try:
+            with db.engine.begin() as connection:
+                migration(connection)
+                connection.execute(SchemaVersion.__table__.insert().values(
+                    version=version,
+                    description=description,
+                    applied_at=datetime.utcnow()
+                ))
+        except IntegrityError:
+            # Another worker applied it first
+            logger.info(f"Schema migration {version} already applied")
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+    run_migrations()
+
+def rebuild_queue_stats(connection, company_id=None):
+    # Recompute QueueStats from QueueHistory, for one company or all of them
+    stats = QueueStats.__table__
+    history = QueueHistory.__table__
+    served = db.case((history.c.status == 'served', 1), else_=0)
+    
+    if connection.dialect.name != 'sqlite':
+        # Hold off counter updates until the new totals are in; SQLite's
+        # write lock already does this
+        connection.execute(db.text('LOCK TABLE queue_stats IN SHARE ROW EXCLUSIVE MODE'))
+    
+    delete = stats.delete()
+    totals = db.select(
+        history.c.company_id,
+        history.c.cashier_number,
+        db.func.sum(served),
+        db.func.sum(db.case((history.c.status == 'removed', 1), else_=0)),
+        db.func.sum(db.case((history.c.delays > 0, 1), else_=0)),
+        db.func.coalesce(db.func.sum(served * db.func.coalesce(history.c.wait_time_seconds, 0)), 0)
+    ).group_by(history.c.company_id, history.c.cashier_number)
+    if company_id is not None:
+        delete = delete.where(stats.c.company_id == company_id)
+        totals = totals.where(history.c.company_id == company_id)
+    
+    connection.execute(delete)
+    connection.execute(stats.insert().from_select([
+        'company_id', 'cashier_number', 'served_count', 'removed_count', 'delayed_count', 'wait_seconds_total'
+    ], totals))
+
+@app.cli.command('rebuild-stats')
+@click.option('--company', 'company_id', type=int, help='Only rebuild this company.')
+def rebuild_stats_command(company_id):
+    """Recompute queue statistics from history."""
+    with db.engine.begin() as connection:
+        rebuild_queue_stats(connection, company_id)
+    logger.info(f"Rebuilt queue statistics for {f'company {company_id}' if company_id else 'all companies'}")
+
+# Customer retention - served and removed customers are moved to
+# customer_archive in batches once they joined more than CUSTOMER_RETENTION_HOURS
+# ago, so Customer stays proportional to the live queues. Each batch is its own
+# short transaction. Every worker runs the job every ARCHIVE_INTERVAL_SECONDS
+# (0 turns it off, e.g. to run `flask --app app archive-customers` from cron);
+# workers racing for the same batch simply retry on the next run.
+CUSTOMER_RETENTION_HOURS = float(os.getenv('CUSTOMER_RETENTION_HOURS', '24'))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv('ARCHIVE_INTERVAL_SECONDS', '600'))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', '500'))
+ARCHIVE_COLUMNS = ['id', 'cashier_id', 'otp', 'join_time', 'served_time', 'status', 'delays', 'ticket', 'serving_start_time']
+
+def archive_finished_customers(retention_hours=None, batch_size=None):
+    retention_hours = CUSTOMER_RETENTION_HOURS if retention_hours is None else retention_hours
+    batch_size = batch_size or ARCHIVE_BATCH_SIZE
+    customers = Customer.__table__
+    archive = CustomerArchive.__table__
+    cutoff = datetime.utcnow() - timedelta(hours=retention_hours)
+    
+    moved = 0
+    while True:
+        with db.engine.begin() as connection:
+            ids = connection.execute(
+                db.select(customers.c.id)
+                .where(customers.c.status.in_(['served', 'removed']), customers.c.join_time < cutoff)
+                .order_by(customers.c.id)
+                .limit(batch_size)
+            ).scalars().all()
+            if ids:
+                now = datetime.utcnow()
+                connection.execute(archive.insert().from_select(
+                    ARCHIVE_COLUMNS + ['archived_at'],
+                    db.select(*[customers.c[Customer.__mapper__.columns[name].name] for name in ARCHIVE_COLUMNS],
+                              db.literal(now, db.DateTime))
+                    .where(customers.c.id.in_(ids))
+                ))
+                connection.execute(customers.delete().where(customers.c.id.in_(ids)))
+        moved += len(ids)
+        if len(ids) < batch_size:
+            return moved
+        # Let requests in between batches
+        socketio.sleep(0)
+
+def archive_loop():
+    while True:
+        socketio.sleep(ARCHIVE_INTERVAL_SECONDS)
+        try:
+            with app.app_context():
+                moved = archive_finished_customers()
+            if moved:
+                logger.info(f"Archived {moved} finished customers")
+        except IntegrityError:
+            logger.info("Finished customers are being archived by another worker")
+        except Exception as e:
+            logger.error(f"Error archiving finished customers: {str(e)}")
+            logger.error(traceback.format_exc())
+
+@app.cli.command('archive-customers')
+@click.option('--retention-hours', type=float, help='Keep customers who joined more recently than this.')
+@click.option('--batch-size', type=int, help='Customers moved per transaction.')
+def archive_customers_command(retention_hours, batch_size):
+    """Move finished customers to customer_archive."""
+    moved = archive_finished_customers(retention_hours, batch_size)
+    logger.info(f"Archived {moved} finished customers")
+
+# Queue engine - the live state of every cashier's queue is held in memory so
+# position and status reads never touch the database. Changes are written
+# through to Customer/QueueHistory and committed before memory is updated, and
+# the whole state is rebuilt from the database at startup.
+#
+# The engine is authoritative for its own process. When several workers share
+# the database (SOCKETIO_MESSAGE_QUEUE is set) each cashier is reloaded before
+# every write and at most QUEUE_ENGINE_TTL seconds after its last load.
+QUEUE_ENGINE_TTL = float(os.getenv('QUEUE_ENGINE_TTL', '2' if SOCKETIO_MESSAGE_QUEUE else '0'))
+
+class QueuedCustomer:
+    __slots__ = ('id', 'otp', 'cashier_id', 'ticket', 'status', 'join_time', 'serving_start_time', 'delays')
+    
+    # Customers leave the engine once they are served
+    served_time = None
+
+    def __init__(self, customer):
+        self.id = customer.id
+        self.otp = customer.otp
+        self.cashier_id = customer.cashier_id
+        self.ticket = customer.ticket
+        self.status = customer.status
+        self.join_time = customer.join_time
+        self.serving_start_time = customer.serving_start_time
+        self.delays = customer.delays or 0
+
+class CashierQueue:
+    def __init__(self, cashier_id):
+        self.id = cashier_id
+        self.lock = threading.RLock()
+        self.serving = None
+        self.tickets = []  # waiting tickets in queue order
+        self.waiting = {}  # ticket -> QueuedCustomer
+        self.last_ticket = 0
+        self.loaded_at = 0
+        self.service_seconds = None
+        self.version = 0
+        self.changed = socketio.server.eio.create_event()
+        # What admins were last told, kept across reloads (see emit_queue_updated)
+        self.pushed_records = {}  # customer id -> (ticket, status, delays)
+
+    def touch(self):
+        # Called after every change - wakes whoever waits on the old event
+        self.version += 1
+        changed, self.changed = self.changed, socketio.server.eio.create_event()
+        changed.set()
+
+    def reset(self, cashier, customers, last_ticket):
+        self.company_id = cashier.company_id
+        self.company_code = cashier.company.company_code
+        self.cashier_number = cashier.cashier_number
+        self.is_active = cashier.is_active
+        self.serving = None
+        self.tickets = []
+        self.waiting = {}
+        self.last_ticket = last_ticket or 0
+        self.loaded_at = time.monotonic()
+        self.service_seconds = None
+        for entry in customers:
+            if entry.status == 'serving' and self.serving is None:
+                self.serving = entry
+            else:
+                entry.status = 'waiting'
+                self.add(entry)
+        self.touch()
+
+    def add(self, entry):
+        if self.tickets and entry.ticket < self.tickets[-1]:
+            bisect.insort(self.tickets, entry.ticket)
+        else:
+            self.tickets.append(entry.ticket)
+        self.waiting[entry.ticket] = entry
+
+    def discard(self, entry):
+        if self.serving is entry:
+            self.serving = None
+        elif self.waiting.pop(entry.ticket, None) is not None:
+            del self.tickets[bisect.bisect_left(self.tickets, entry.ticket)]
+
+    def peek(self):
+        return self.waiting[self.tickets[0]] if self.tickets else None
+
+    def position(self, entry):
+        # Same rule as the database model: serving is 1, waiting counts the tickets ahead
+        if entry.status == 'serving':
+            return 1
+        return bisect.bisect_left(self.tickets, entry.ticket) + 1
+
+    def ordered(self):
+        customers = [self.waiting[ticket] for ticket in self.tickets]
+        return [self.serving] + customers if self.serving else customers
+
+    def line_times(self):
+        # Join times with delays applied, by customer id: a delayed customer was
+        # sent behind everyone waiting, so nobody counts as having joined before
+        # someone ahead of them. Never decreases along the queue
+        times = {}
+        latest = None
+        for ticket in self.tickets:
+            entry = self.waiting[ticket]
+            latest = entry.join_time if latest is None else max(latest, entry.join_time)
+            times[entry.id] = latest
+        return times
+
+class QueueEngine:
+    def __init__(self, ttl=0):
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.cashiers = {}          # cashier_id -> CashierQueue
+        self.company_cashiers = {}  # company_id -> [cashier_id]
+        self.by_otp = {}
+        self.by_id = {}
+
+    def rebuild(self):
+        with self.lock:
+            self.cashiers.clear()
+            self.company_cashiers.clear()
+            self.by_otp.clear()
+            self.by_id.clear()
+            
+            cashiers = Cashier.query.order_by(Cashier.company_id, Cashier.cashier_number).all()
+            last_tickets = dict(db.session.query(Customer.cashier_id, db.func.max(Customer.ticket)).group_by(Customer.cashier_id).all())
+            active = {}
+            for customer in Customer.query.filter(Customer.status.in_(['waiting', 'serving'])).order_by(Customer.ticket):
+                active.setdefault(customer.cashier_id, []).append(customer)
+            
+            for cashier in cashiers:
+                self.company_cashiers.setdefault(cashier.company_id, []).append(cashier.id)
+                self._install(cashier, active.get(cashier.id, []), last_tickets.get(cashier.id))
+            # Keeps any serving rows _install sent back to waiting
+            db.session.commit()
+            logger.info(f"Queue engine loaded {len(self.by_id)} active customers for {len(cashiers)} cashiers")
+
+    def _install(self, cashier, customers, last_ticket):
+        queue = self.cashiers.get(cashier.id)
+        if queue is None:
+            queue = self.cashiers[cashier.id] = CashierQueue(cashier.id)
+        else:
+            for entry in queue.ordered():
+                self._unindex(entry)
+        
+        # Older data may have more than one customer marked as serving - keep
+        # the one who joined first and send the rest back to waiting. Written as
+        # part of the caller's transaction, which may hold the company lock
+        serving = sorted((c for c in customers if c.status == 'serving'), key=lambda c: c.join_time)
+        if len(serving) > 1:
+            logger.warning(f"Multiple serving customers detected for cashier {cashier.id}. Found {len(serving)} serving customers.")
+            for customer in serving[1:]:
+                customer.status = 'waiting'
+                customer.serving_start_time = None
+            db.session.flush()
+        
+        queue.reset(cashier, [QueuedCustomer(c) for c in customers], last_ticket)
+        for entry in queue.ordered():
+            self._index(entry)
+        return queue
+
+    def _index(self, entry):
+        self.by_otp[entry.otp] = entry
+        self.by_id[entry.id] = entry
+
+    def _unindex(self, entry):
+        self.by_otp.pop(entry.otp, None)
+        self.by_id.pop(entry.id, None)
+
+    def reload_cashier(self, cashier_id):
+        cashier = Cashier.query.get(cashier_id)
+        if not cashier:
+            return None
+        customers = Customer.query.filter(
+            Customer.cashier_id == cashier_id,
+            Customer.status.in_(['waiting', 'serving'])
+        ).order_by(Customer.ticket).all()
+        last_ticket = db.session.query(db.func.max(Customer.ticket)).filter(Customer.cashier_id == cashier_id).scalar()
+        with self.lock:
+            return self._install(cashier, customers, last_ticket)
+
+    def _expired(self, queue):
+        return self.ttl > 0 and time.monotonic() - queue.loaded_at > self.ttl
+
+    def _sync(self, queue, entry=None):
+        # Other workers may have changed this queue, so writes take the company
+        # lock and start from what the database holds
+        if self.ttl > 0:
+            lock_company(queue.company_id)
+            self.reload_cashier(queue.id)
+            if entry is not None:
+                entry = self.by_id.get(entry.id)
+                if entry is None:
+                    db.session.rollback()
+                    raise LookupError('Customer is no longer in the queue')
+        return entry
+
+    def get_cashier(self, cashier_id):
+        queue = self.cashiers.get(cashier_id)
+        if queue is None or self._expired(queue):
+            queue = self.reload_cashier(cashier_id)
+        return queue
+
+    def company_queues(self, company_id):
+        cashier_ids = self.company_cashiers.get(company_id)
+        if cashier_ids is None:
+            cashier_ids = [c.id for c in Cashier.query.filter_by(company_id=company_id).order_by(Cashier.cashier_number)]
+            self.company_cashiers[company_id] = cashier_ids
+        return [queue for queue in (self.get_cashier(cashier_id) for cashier_id in cashier_ids) if queue]
+
+    def update_cashier(self, cashier_id, is_active):
+        queue = self.cashiers.get(cashier_id)
+        if queue:
+            queue.is_active = is_active
+            queue.touch()
+
+    def find(self, otp):
+        entry = self.by_otp.get(otp)
+        if entry and self._expired(self.cashiers[entry.cashier_id]):
+            self.reload_cashier(entry.cashier_id)
+            entry = self.by_otp.get(otp)
+        elif entry is None and self.ttl > 0:
+            # The customer may have joined through another worker
+            customer = Customer.query.filter(Customer.otp == otp, Customer.status.in_(['waiting', 'serving'])).first()
+            if customer:
+                self.reload_cashier(customer.cashier_id)
+                entry = self.by_otp.get(otp)
+        return entry
+
+    def find_by_id(self, customer_id):
+        entry = self.by_id.get(customer_id)
+        if entry and self._expired(self.cashiers[entry.cashier_id]):
+            self.reload_cashier(entry.cashier_id)
+            entry = self.by_id.get(customer_id)
+        elif entry is None and self.ttl > 0:
+            customer = Customer.query.get(customer_id)
+            if customer and customer.status in ['waiting', 'serving']:
+                self.reload_cashier(customer.cashier_id)
+                entry = self.by_id.get(customer_id)
+        return entry
+
+    def position(self, entry):
+        return self.cashiers[entry.cashier_id].position(entry)
+
+    def service_time(self, queue):
+        if queue.service_seconds is None:
+            queue.service_seconds = estimate_service_time(queue.id)
+        return queue.service_seconds
+
+    def join(self, company_id, otp):
+        """Add a customer to the active cashier with the fewest waiting customers.
+        Returns (queue, entry), or (None, None) if no cashier is active."""
+        if self.ttl > 0:
+            return self._join_shared(company_id, otp)
+        
+        # Choice and ticket come from memory; the cashier's lock serializes
+        # joins against every other change to that queue
+        queues = [queue for queue in self.company_queues(company_id) if queue.is_active]
+        if not queues:
+            return None, None
+        queue = min(queues, key=lambda queue: len(queue.tickets))
+        
+        with queue.lock:
+            # The first customer of an idle cashier goes straight to the counter
+            is_first = queue.serving is None and not queue.tickets
+            customer = self._insert(queue.id, otp, queue.last_ticket + 1, is_first)
+            db.session.flush()
+            entry = QueuedCustomer(customer)
+            self._commit(queue)
+            
+            queue.last_ticket = entry.ticket
+            if is_first:
+                queue.serving = entry
+            else:
+                queue.add(entry)
+            self._index(entry)
+            queue.touch()
+            return queue, entry
+
+    def _join_shared(self, company_id, otp):
+        # Other workers join customers too, so choose the cashier and allocate the
+        # ticket with one grouped query while holding the company lock
+        lock_company(company_id)
+        waiting = db.func.sum(db.case((Customer.status == 'waiting', 1), else_=0))
+        choice = db.session.query(
+            Cashier.id,
+            waiting.label('waiting'),
+            db.func.count(Customer.id).label('active'),
+            db.func.max(Customer.ticket).label('last_ticket')
+        ).outerjoin(Customer, db.and_(
+            Customer.cashier_id == Cashier.id,
+            Customer.status.in_(['waiting', 'serving'])
+        )).filter(
+            Cashier.company_id == company_id,
+            Cashier.is_active.is_(True)
+        ).group_by(Cashier.id, Cashier.cashier_number).order_by(waiting, Cashier.cashier_number).first()
+        
+        if choice is None:
+            db.session.rollback()
+            return None, None
+        
+        customer = self._insert(choice.id, otp, (choice.last_ticket or 0) + 1, choice.active == 0)
+        db.session.commit()
+        queue = self.reload_cashier(choice.id)
+        return queue, self.by_id[customer.id]
+
+    def _insert(self, cashier_id, otp, ticket, is_first):
+        now = datetime.utcnow()
+        customer = Customer(
+            cashier_id=cashier_id,
+            otp=otp,
+            ticket=ticket,
+            status='serving' if is_first else 'waiting',
+            join_time=now,
+            serving_start_time=now if is_first else None
+        )
+        db.session.add(customer)
+        return customer
+
+    def serve(self, queue):
+        """Finish the customer at the counter and call the next one."""
+        with queue.lock:
+            self._sync(queue)
+            now = datetime.utcnow()
+            
+            finished = queue.serving
+            if finished:
+                logger.info(f"Marking customer {finished.otp} as served")
+                self._finish(queue, finished, 'served', now)
+                
+                # Feed the time spent at the counter into the cashier's estimate
+                if finished.serving_start_time:
+                    record_service_time(queue, (now - finished.serving_start_time).total_seconds())
+            
+            next_entry = self._write_next(queue, now)
+            self._commit(queue)
+            
+            if finished:
+                queue.discard(finished)
+                queue.service_seconds = None
+                self._unindex(finished)
+            self._apply_next(queue, next_entry, now)
+            return finished, next_entry
+
+    def remove(self, entry):
+        """Remove a customer; if they were at the counter the next one is called.
+        Returns (entry, next_entry)."""
+        queue = self.cashiers[entry.cashier_id]
+        with queue.lock:
+            entry = self._sync(queue, entry)
+            now = datetime.utcnow()
+            was_serving = entry.status == 'serving'
+            logger.info(f"Removing customer {entry.otp} with ticket {entry.ticket}")
+            self._finish(queue, entry, 'removed', now)
+            next_entry = self._write_next(queue, now, after=entry) if was_serving else None
+            self._commit(queue)
+            
+            queue.discard(entry)
+            self._unindex(entry)
+            entry.status = 'removed'
+            self._apply_next(queue, next_entry, now)
+            return entry, next_entry
+
+    def delay(self, entry):
+        """Send the serving customer to the back of the queue, or remove them on
+        their third delay, and call the next customer. Returns (entry, next_entry)."""
+        queue = self.cashiers[entry.cashier_id]
+        with queue.lock:
+            entry = self._sync(queue, entry)
+            now = datetime.utcnow()
+            entry.delays += 1
+            logger.info(f"Customer {entry.otp} delayed, delay count now: {entry.delays}")
+            
+            if entry.delays >= 3:
+                logger.info(f"Customer {entry.otp} has been delayed 3 times, removing from queue")
+                self._finish(queue, entry, 'removed', now)
+                next_entry = self._write_next(queue, now, after=entry)
+                self._commit(queue)
+                
+                queue.discard(entry)
+                self._unindex(entry)
+                entry.status = 'removed'
+                self._apply_next(queue, next_entry, now)
+                return entry, next_entry
+            
+            ticket = queue.last_ticket + 1
+            Customer.query.filter_by(id=entry.id).update({
+                'status': 'waiting',
+                'serving_start_time': None,
+                'delays': entry.delays,
+                'ticket': ticket
+            })
+            
+            # A customer delayed with nobody else waiting is called straight back
+            next_entry = self._write_next(queue, now, after=entry) or entry
+            if next_entry is entry:
+                Customer.query.filter_by(id=entry.id).update({'status': 'serving', 'serving_start_time': now})
+            self._commit(queue)
+            
+            queue.discard(entry)
+            queue.last_ticket = ticket
+            entry.ticket = ticket
+            entry.status = 'waiting'
+            entry.serving_start_time = None
+            queue.add(entry)
+            self._apply_next(queue, next_entry, now)
+            return entry, next_entry
+
+    def close_cashier(self, queue):
+        """Deactivate a cashier and move its waiting customers to the company's
+        other active cashiers in one transaction. Returns (targets, called,
+        moved): the queues that took customers, the customers called to an idle
+        counter and how many customers were moved, or (None, None, 0) if no
+        other cashier is active."""
+        queues = sorted(self.company_queues(queue.company_id), key=lambda queue: queue.id)
+        with ExitStack() as locks:
+            # Every queue of the company changes - lock them in a fixed order
+            for other in queues:
+                locks.enter_context(other.lock)
+            if self.ttl > 0:
+                lock_company(queue.company_id)
+                for other in queues:
+                    self.reload_cashier(other.id)
+            
+            targets = [other for other in queues if other.is_active and other is not queue]
+            if not targets:
+                db.session.rollback()
+                return None, None, 0
+            now = datetime.utcnow()
+            
+            # Deal the moved customers out to the shortest queues in their own
+            # order, like joins would have been, then merge each queue by join
+            # time with delays applied. Both lines are in that order, so nobody
+            # moves ahead of someone who was waiting longer or who was ahead of
+            # them in their own line
+            moving = [queue.waiting[ticket] for ticket in queue.tickets]
+            times = queue.line_times()
+            incoming = {other.id: [] for other in targets}
+            sizes = {other.id: len(other.tickets) for other in targets}
+            for entry in moving:
+                target = min(targets, key=lambda other: (sizes[other.id], other.cashier_number))
+                incoming[target.id].append(entry)
+                sizes[target.id] += 1
+            
+            plans = []
+            rows = []
+            for target in targets:
+                if not incoming[target.id]:
+                    continue
+                existing = [target.waiting[ticket] for ticket in target.tickets]
+                times.update(target.line_times())
+                merged = list(heapq.merge(existing, incoming[target.id], key=lambda entry: times[entry.id]))
+                called = merged.pop(0) if target.serving is None else None
+                # Customers ahead of the first newcomer keep their tickets, the
+                # rest are numbered after the last ticket in merged order. A
+                # newcomer called to the counter needs a ticket of this cashier too
+                next_ticket = target.last_ticket + 1
+                called_ticket = called.ticket if called is not None else None
+                if called is not None and called.cashier_id != target.id:
+                    called_ticket = next_ticket
+                    next_ticket += 1
+                keep = next(index for index, entry in enumerate(merged + [None]) if entry is None or entry.cashier_id != target.id)
+                tickets = [entry.ticket for entry in merged[:keep]] + list(range(next_ticket, next_ticket + len(merged) - keep))
+                plans.append((target, merged, tickets, called, called_ticket))
+                
+                if called is not None:
+                    rows.append({'id': called.id, 'cashier_id': target.id, 'ticket': called_ticket,
+                                 'status': 'serving', 'serving_start_time': now})
+                rows.extend({'id': entry.id, 'cashier_id': target.id, 'ticket': ticket,
+                             'status': 'waiting', 'serving_start_time': None}
+                            for entry, ticket in zip(merged[keep:], tickets[keep:]))
+            
+            db.session.execute(db.update(Cashier).where(Cashier.id == queue.id).values(is_active=False))
+            if rows:
+                db.session.execute(db.update(Customer), rows)
+            self._commit(queue)
+            
+            logger.info(f"Closed cashier {queue.id}, moved {len(moving)} waiting customers to {len(plans)} cashiers")
+            queue.is_active = False
+            queue.tickets = []
+            queue.waiting = {}
+            queue.touch()
+            for target, merged, tickets, called, called_ticket in plans:
+                target.tickets = []
+                target.waiting = {}
+                for entry, ticket in zip(merged, tickets):
+                    entry.cashier_id = target.id
+                    entry.ticket = ticket
+                    target.add(entry)
+                target.last_ticket = max([target.last_ticket, called_ticket or 0] + tickets[-1:])
+                if called is not None:
+                    called.cashier_id = target.id
+                    called.ticket = called_ticket
+                    called.status = 'serving'
+                    called.serving_start_time = now
+                    target.serving = called
+                target.touch()
+            return [plan[0] for plan in plans], [plan[3] for plan in plans if plan[3] is not None], len(moving)
+
+    def serve_many(self, queue, count):
+        """Serve `count` times in one transaction: like pressing serve `count`
+        times, each press finishes the customer at the counter and calls the next
+        one. Returns (finished, next_entry)."""
+        with queue.lock:
+            self._sync(queue)
+            now = datetime.utcnow()
+            line = queue.ordered()
+            called = count if queue.serving else count - 1
+            finished, next_entry = line[:called], (line[called] if called < len(line) else None)
+            
+            self._finish_many(queue, finished, 'served', now)
+            serving = queue.serving
+            if finished and finished[0] is serving and serving.serving_start_time:
+                # Only the customer already at the counter was timed
+                record_service_time(queue, (now - serving.serving_start_time).total_seconds())
+            if next_entry is not None:
+                Customer.query.filter_by(id=next_entry.id).update({'status': 'serving', 'serving_start_time': now})
+            self._commit(queue)
+            
+            for entry in finished:
+                queue.discard(entry)
+                self._unindex(entry)
+                entry.status = 'served'
+            if finished:
+                queue.service_seconds = None
+            self._apply_next(queue, next_entry, now)
+            return finished, next_entry
+
+    def remove_many(self, entries):
+        """Remove several customers, from any cashiers, in one transaction. A
+        cashier whose customer at the counter is removed calls the next one.
+        Returns [(queue, removed, next_entry)] for every cashier involved."""
+        queues = sorted({entry.cashier_id: self.cashiers[entry.cashier_id] for entry in entries}.values(),
+                        key=lambda queue: queue.id)
+        with ExitStack() as locks:
+            for queue in queues:
+                locks.enter_context(queue.lock)
+            if self.ttl > 0:
+                for company_id in sorted({queue.company_id for queue in queues}):
+                    lock_company(company_id)
+                for queue in queues:
+                    self.reload_cashier(queue.id)
+                entries = [self.by_id[entry.id] for entry in entries if entry.id in self.by_id]
+            now = datetime.utcnow()
+            
+            plans = []
+            calls = []
+            for queue in queues:
+                removed = {entry.id: entry for entry in entries if entry.cashier_id == queue.id}
+                next_entry = None
+                if queue.serving is not None and queue.serving.id in removed:
+                    next_entry = next((queue.waiting[ticket] for ticket in queue.tickets
+                                       if queue.waiting[ticket].id not in removed), None)
+                    if next_entry is not None:
+                        calls.append({'id': next_entry.id, 'status': 'serving', 'serving_start_time': now})
+                self._finish_many(queue, list(removed.values()), 'removed', now)
+                plans.append((queue, list(removed.values()), next_entry))
+            if calls:
+                db.session.execute(db.update(Customer), calls)
+            self._commit(*queues)
+            
+            for queue, removed, next_entry in plans:
+                for entry in removed:
+                    queue.discard(entry)
+                    self._unindex(entry)
+                    entry.status = 'removed'
+                self._apply_next(queue, next_entry, now)
+            return plans
+
+    def _finish_many(self, queue, entries, status, now):
+        # _finish for a batch: one UPDATE, one INSERT and one counter update
+        if not entries:
+            return
+        finished = {'served_time': now} if status == 'served' else {}
+        db.session.execute(db.update(Customer), [
+            {'id': entry.id, 'status': status, 'delays': entry.delays, **finished} for entry in entries
+        ])
+        history = [{
+            'company_id': queue.company_id,
+            'cashier_number': queue.cashier_number,
+            'otp': entry.otp,
+            'join_time': entry.join_time,
+            'served_time': now,
+            'wait_time_seconds': int((now - entry.join_time).total_seconds()),
+            'status': status,
+            'delays': entry.delays
+        } for entry in entries]
+        db.session.execute(db.insert(QueueHistory), history)
+        
+        counts = {}
+        for row in history:
+            for name, value in history_stats_counts(status, row['wait_time_seconds'], row['delays']).items():
+                counts[name] = counts.get(name, 0) + value
+        add_queue_stats(queue.company_id, queue.cashier_number, counts)
+
+    def _finish(self, queue, entry, status, now):
+        update = {'status': status}
+        if status == 'served':
+            update['served_time'] = now
+        if status == 'removed':
+            update['delays'] = entry.delays
+        Customer.query.filter_by(id=entry.id).update(update)
+        db.session.add(QueueHistory(
+            company_id=queue.company_id,
+            cashier_number=queue.cashier_number,
+            otp=entry.otp,
+            join_time=entry.join_time,
+            served_time=now,
+            wait_time_seconds=int((now - entry.join_time).total_seconds()),
+            status=status,
+            delays=entry.delays
+        ))
+        record_history_stats(queue.company_id, queue.cashier_number, status,
+                             int((now - entry.join_time).total_seconds()), entry.delays)
+
+    def _write_next(self, queue, now, after=None):
+        next_entry = queue.peek()
+        if next_entry is not None and next_entry is not after:
+            Customer.query.filter_by(id=next_entry.id).update({'status': 'serving', 'serving_start_time': now})
+            return next_entry
+        return None
+
+    def _apply_next(self, queue, next_entry, now):
+        # Last step of every change to a queue
+        if next_entry is not None:
+            queue.discard(next_entry)
+            next_entry.status = 'serving'
+            next_entry.serving_start_time = now
+            queue.serving = next_entry
+        queue.touch()
+
+    def _commit(self, *queues):
+        try:
+            db.session.commit()
+        except Exception:
+            # Memory has not been touched yet, but the database may have
+            # moved on under us - start again from what it holds
+            db.session.rollback()
+            for queue in queues:
+                self.reload_cashier(queue.id)
+            raise
+
+def lock_company(company_id):
+    # Serializes queue writes for one company until the transaction ends: a row
+    # lock on Postgres; SQLite has no FOR UPDATE, so take its write lock up front
+    if db.engine.dialect.name == 'sqlite':
+        db.session.execute(db.update(Company).where(Company.id == company_id).values(id=Company.id))
+    else:
+        db.session.query(Company.id).filter(Company.id == company_id).with_for_update().one()
+
+queue_engine = QueueEngine(ttl=QUEUE_ENGINE_TTL)
 
 # Create database tables at startup
 with app.app_context():
     try:
         logger.info("Attempting to create/verify database tables...")
         db.create_all()
+        run_migrations()
         logger.info("Database tables verified/created successfully")
         
+        # Load every active queue into memory
+        queue_engine.rebuild()
+        
+        if ARCHIVE_INTERVAL_SECONDS > 0:
+            socketio.start_background_task(archive_loop)
+        
         # First-time setup - create default admin if none exists
         admin_count = Admin.query.count()
         if admin_count == 0:
@@ -171,22 +1405,453 @@ def generate_company_code():
     letters = string.ascii_uppercase
     return ''.join(secrets.choice(letters) for _ in range(6))
 
-def generate_otp():
-    digits = string.digits
-    return ''.join(secrets.choice(digits) for _ in range(6))
+# OTP allocation - an OTP is a shared counter put through a keyed permutation of
+# 000000-999999, so consecutive customers get unrelated codes and no two of any
+# million consecutive allocations are equal. Each worker reserves
+# OTP_BLOCK_SIZE counter values at a time in its own short transaction and hands
+# them out from memory, so most joins run no OTP query at all. The key is
+# generated with the counter and kept next to it in otp_sequence, so every
+# worker and every restart uses the same permutation.
+OTP_SPACE = 10 ** 6
+OTP_BLOCK_SIZE = int(os.getenv('OTP_BLOCK_SIZE', '100'))
+OTP_FEISTEL_ROUNDS = 4
+
+class OtpAllocator:
+    def __init__(self, block_size):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.blocks = deque()  # reserved counter ranges, oldest first
+        self.key = None
+
+    def allocate(self):
+        with self.lock:
+            value = self._take()
+        if value is None:
+            # Reserve without holding the lock: the reservation needs a pooled
+            # connection, which a request waiting on the lock may be holding
+            block = self._reserve()
+            with self.lock:
+                self.blocks.append(block)
+                value = self._take()
+        return f'{self.permute(value % OTP_SPACE):06d}'
+
+    def _take(self):
+        while self.blocks:
+            value = next(self.blocks[0], None)
+            if value is not None:
+                return value
+            self.blocks.popleft()
+        return None
+
+    def permute(self, value):
+        # Balanced Feistel network on the two halves of a 6-digit number - a
+        # bijection on 0..999999 for any key and round function
+        left, right = divmod(value, 1000)
+        for round_number in range(OTP_FEISTEL_ROUNDS):
+            digest = hashlib.blake2b(f'{round_number}:{right}'.encode(), key=self.key, digest_size=4).digest()
+            left, right = right, (left + int.from_bytes(digest, 'big')) % 1000
+        return left * 1000 + right
+
+    def _reserve(self):
+        sequence = OtpSequence.__table__
+        try:
+            with db.engine.begin() as connection:
+                row = connection.execute(
+                    sequence.update()
+                    .where(sequence.c.id == 1)
+                    .values(next_value=sequence.c.next_value + self.block_size)
+                    .returning(sequence.c.next_value, sequence.c.key)
+                ).first()
+                if row is None:
+                    row = (self.block_size, secrets.token_hex(32))
+                    connection.execute(sequence.insert().values(id=1, next_value=row[0], key=row[1]))
+        except IntegrityError:
+            # Another worker created the sequence first
+            return self._reserve()
+        self.key = bytes.fromhex(row[1])
+        return iter(range(row[0] - self.block_size, row[0]))
+
+otp_allocator = OtpAllocator(OTP_BLOCK_SIZE)
+
+# Service time estimation - an exponentially weighted moving average per cashier.
+# The first few samples are averaged plainly, after that each new sample weighs
+# about as much as the last SERVICE_TIME_MIN_SAMPLES customers together.
+DEFAULT_SERVICE_SECONDS = 180  # 3 minutes default
+SERVICE_TIME_MIN_SAMPLES = 5
+SERVICE_TIME_ALPHA = 2 / (SERVICE_TIME_MIN_SAMPLES + 1)
+
+def estimate_service_time(cashier_id):
+    # Average serving time (default to 3 minutes if not enough data)
+    estimate = ServiceTimeEstimate.query.get(cashier_id)
+    if not estimate or estimate.samples < SERVICE_TIME_MIN_SAMPLES:
+        return DEFAULT_SERVICE_SECONDS
+    return estimate.avg_service_seconds
+
+def emit_queue_updated(queue):
+    # Push the new state instead of asking admins to refetch it: they get a diff
+    # of the queue. Positions follow from ticket order, so a serve sends only the
+    # finished and the newly called customer. Customers follow their own ticket
+    # over /api/stream, which wakes on the queue's change event instead
+    with queue.lock:
+        service_seconds = queue_engine.service_time(queue)
+        records = {}
+        upserted = []
+        for customer in queue.ordered():
+            records[customer.id] = (customer.ticket, customer.status, customer.delays)
+            if queue.pushed_records.get(customer.id) != records[customer.id]:
+                upserted.append({
+                    'id': customer.id,
+                    'otp': customer.otp,
+                    'ticket': customer.ticket,
+                    'status': customer.status,
+                    'delays': customer.delays,
+                    'join_time': customer.join_time.strftime('%H:%M:%S'),
+                    'serving_start_time': customer.serving_start_time.strftime('%H:%M:%S') if customer.serving_start_time else None
+                })
+        
+        removed = [customer_id for customer_id in queue.pushed_records if customer_id not in records]
+        queue.pushed_records = records
+    
+    socketio.emit('queue_updated', {
+        'cashier_id': queue.id,
+        'company_code': queue.company_code,
+        'timestamp': datetime.utcnow().isoformat(),
+        'service_seconds': service_seconds,
+        'size': len(records),
+        'removed': removed,
+        'upserted': upserted
+    }, to=admin_room(queue.company_code))
+
+# Queue update coalescing - a burst of changes to one cashier (quick clicks, a
+# delay that also calls the next customer) is pushed as one queue_updated diff.
+# Changes mark the cashier dirty and a background greenlet pushes the latest
+# state of every dirty cashier once per window. QUEUE_EVENT_WINDOW_MS=0 pushes
+# immediately
+QUEUE_EVENT_WINDOW = float(os.getenv('QUEUE_EVENT_WINDOW_MS', '100')) / 1000
+
+class EventCoalescer:
+    def __init__(self, window):
+        self.window = window
+        self.lock = threading.Lock()
+        self.pending = {}  # cashier_id -> CashierQueue
+        self.running = False
+        # Counted under the lock as each happens; once nothing is pending,
+        # requested = emitted + failed + collapsed
+        self.requested = 0
+        self.emitted = 0
+        self.failed = 0
+        self.collapsed = 0
+
+    def queue_updated(self, queue):
+        if self.window <= 0:
+            with self.lock:
+                self.requested += 1
+            self._emit(queue)
+            return
+        with self.lock:
+            self.requested += 1
+            if queue.id in self.pending:
+                self.collapsed += 1
+            self.pending[queue.id] = queue
+            start = not self.running
+            self.running = True
+        if start:
+            socketio.start_background_task(self._run)
+
+    def _run(self):
+        # Runs while there is something to push, then exits until the next change
+        while True:
+            socketio.sleep(self.window)
+            with app.app_context():
+                self.flush()
+            with self.lock:
+                if not self.pending:
+                    self.running = False
+                    return
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for queue in pending.values():
+            self._emit(queue)
+
+    def _emit(self, queue):
+        try:
+            emit_queue_updated(queue)
+        except Exception as e:
+            with self.lock:
+                self.failed += 1
+            logger.error(f"Error pushing queue update for cashier {queue.id}: {str(e)}")
+            logger.error(traceback.format_exc())
+        else:
+            with self.lock:
+                self.emitted += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'window_ms': self.window * 1000,
+                'requested': self.requested,
+                'emitted': self.emitted,
+                'failed': self.failed,
+                'pending': len(self.pending),
+                'collapsed': self.collapsed
+            }
+
+event_coalescer = EventCoalescer(QUEUE_EVENT_WINDOW)
 
-def calculate_wait_time(cashier_id):
-    customers = Customer.query.filter_by(cashier_id=cashier_id, status='waiting').order_by(Customer.position).all()
-    history = QueueHistory.query.filter_by(cashier_number=Cashier.query.get(cashier_id).cashier_number)
+# Metadata cache - companies and cashiers only change when an admin creates a
+# company or switches a cashier on or off, so the public routes read them from a
+# per-process LRU cache of plain snapshots instead of the database. Entries live
+# for METADATA_CACHE_TTL seconds (0 turns the cache off). The routes that change
+# them invalidate the keys here and, with a message queue, in every other worker
+# through METADATA_CHANNEL on the same broker; the TTL bounds staleness if such
+# a message is lost. Unknown company codes are cached too.
+METADATA_CACHE_TTL = float(os.getenv('METADATA_CACHE_TTL', '60'))
+METADATA_CACHE_SIZE = int(os.getenv('METADATA_CACHE_SIZE', '10000'))
+METADATA_CHANNEL = f'{SOCKETIO_CHANNEL}-metadata'
+
+class CashierInfo:
+    def __init__(self, cashier, company):
+        self.id = cashier.id
+        self.company_id = cashier.company_id
+        self.company_code = company.company_code
+        self.admin_id = company.admin_id
+        self.cashier_number = cashier.cashier_number
+        self.is_active = cashier.is_active
+
+class CompanyInfo:
+    def __init__(self, company):
+        self.id = company.id
+        self.name = company.name
+        self.service_type = company.service_type
+        self.company_code = company.company_code
+        self.admin_id = company.admin_id
+        self.cashiers = [CashierInfo(c, company) for c in sorted(company.cashiers, key=lambda c: c.cashier_number)]
+
+class MetadataCache:
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expires, value), least recently used first
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key, load):
+        now = time.monotonic()
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached and cached[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+            generation = self.generation
+        
+        value = load()
+        with self.lock:
+            # Something was invalidated while loading - the value may predate it
+            if self.ttl > 0 and generation == self.generation:
+                self.entries[key] = (now + self.ttl, value)
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        return value
+
+    def invalidate(self, keys):
+        with self.lock:
+            self.generation += 1
+            for key in keys:
+                self.entries.pop(key, None)
+                self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations
+            }
+
+metadata_cache = MetadataCache(METADATA_CACHE_TTL, METADATA_CACHE_SIZE)
+
+def company_info(company_code):
+    # None for unknown codes
+    def load():
+        company = Company.query.options(db.selectinload(Company.cashiers)).filter_by(company_code=company_code).first()
+        return CompanyInfo(company) if company else None
+    return metadata_cache.get(('company', company_code), load)
+
+def cashier_info(cashier_id):
+    def load():
+        row = db.session.query(Cashier, Company).join(Company, Company.id == Cashier.company_id).filter(Cashier.id == cashier_id).first()
+        return CashierInfo(*row) if row else None
+    return metadata_cache.get(('cashier', cashier_id), load)
+
+# Invalidations travel on their own channel through a second manager of the
+# message queue's backend class, so they never pass through Socket.IO event
+# delivery. Only _publish() and _listen(), the pair every python-socketio
+# pub/sub backend implements, are used; checked against python-socketio 5.7.2
+# as pinned in requirements.txt.
+def metadata_channel_manager():
+    manager = type(socketio.server.manager)(SOCKETIO_MESSAGE_QUEUE, channel=METADATA_CHANNEL)
+    manager.set_server(socketio.server)
+    return manager
+
+def invalidate_metadata(company_code, cashier_ids=()):
+    keys = [('company', company_code)] + [('cashier', cashier_id) for cashier_id in cashier_ids]
+    metadata_cache.invalidate(keys)
+    if metadata_manager is not None:
+        metadata_manager._publish({'method': 'invalidate', 'keys': keys, 'host_id': metadata_manager.host_id})
+
+def listen_for_metadata_invalidation(manager, cache):
+    # Runs for the life of the worker; its own messages were applied when sent
+    for message in manager._listen():
+        try:
+            if isinstance(message, bytes):
+                message = pickle.loads(message)
+            if message.get('method') == 'invalidate' and message.get('host_id') != manager.host_id:
+                cache.invalidate(tuple(key) for key in message['keys'])
+        except Exception as e:
+            logger.error(f"Error handling metadata invalidation: {str(e)}")
+
+metadata_manager = None
+if SOCKETIO_MESSAGE_QUEUE:
+    metadata_manager = metadata_channel_manager()
+    socketio.start_background_task(listen_for_metadata_invalidation, metadata_manager, metadata_cache)
+
+def find_customer(otp):
+    # Customers in a queue are answered from the queue engine, finished ones
+    # (served or removed) from the database with no position. None for an
+    # unknown OTP
+    entry = queue_engine.find(otp)
+    if entry:
+        queue = queue_engine.cashiers[entry.cashier_id]
+        return entry, queue, queue.company_code, queue.position(entry)
     
-    # Calculate average serving time (default to 3 minutes if not enough data)
-    served_customers = history.filter(QueueHistory.wait_time_seconds.isnot(None)).all()
-    if len(served_customers) > 5:
-        avg_serving_time = sum(c.wait_time_seconds for c in served_customers[-5:]) / 5  # Last 5 customers
+    # Finished OTPs come round again after a million joins - take the latest
+    customer = Customer.query.filter_by(otp=otp).order_by(Customer.id.desc()).first()
+    if customer is None:
+        # Links to older tickets keep working once they are archived
+        customer = CustomerArchive.query.filter_by(otp=otp).order_by(CustomerArchive.id.desc()).first()
+    cashier = cashier_info(customer.cashier_id) if customer else None
+    if cashier is None:
+        return None
+    return customer, cashier, cashier.company_code, 0
+
+def record_service_time(cashier, service_seconds):
+    estimate = ServiceTimeEstimate.query.get(cashier.id)
+    if not estimate:
+        estimate = ServiceTimeEstimate(
+            cashier_id=cashier.id,
+            company_id=cashier.company_id,
+            avg_service_seconds=service_seconds,
+            samples=1
+        )
+        db.session.add(estimate)
+        return estimate
+    
+    if estimate.samples < SERVICE_TIME_MIN_SAMPLES:
+        estimate.avg_service_seconds += (service_seconds - estimate.avg_service_seconds) / (estimate.samples + 1)
     else:
-        avg_serving_time = 180  # 3 minutes default
+        estimate.avg_service_seconds += SERVICE_TIME_ALPHA * (service_seconds - estimate.avg_service_seconds)
+    estimate.samples += 1
+    return estimate
+
+def history_stats_counts(status, wait_seconds, delays):
+    served = 1 if status == 'served' else 0
+    return {
+        'served_count': served,
+        'removed_count': 1 if status == 'removed' else 0,
+        'delayed_count': 1 if delays > 0 else 0,
+        'wait_seconds_total': wait_seconds if served else 0
+    }
+
+def record_history_stats(company_id, cashier_number, status, wait_seconds, delays):
+    add_queue_stats(company_id, cashier_number, history_stats_counts(status, wait_seconds, delays))
+
+def add_queue_stats(company_id, cashier_number, counts):
+    # One upsert with the counters bumped in SQL, so concurrent writers never
+    # lose an update and two workers writing a cashier's first row never collide
+    stats = QueueStats.__table__
+    dialect = postgresql if db.engine.dialect.name == 'postgresql' else sqlite
+    insert = dialect.insert(stats).values(company_id=company_id, cashier_number=cashier_number, **counts)
+    db.session.execute(insert.on_conflict_do_update(
+        index_elements=[stats.c.company_id, stats.c.cashier_number],
+        set_={name: stats.c[name] + insert.excluded[name] for name in counts}
+    ))
+
+def company_stats(company_ids):
+    # Totals per company, summed over its few cashier rows
+    rows = db.session.query(
+        QueueStats.company_id,
+        db.func.sum(QueueStats.served_count),
+        db.func.sum(QueueStats.delayed_count),
+        db.func.sum(QueueStats.wait_seconds_total)
+    ).filter(QueueStats.company_id.in_(company_ids)).group_by(QueueStats.company_id)
+    
+    stats = {company_id: {'total_served': 0, 'total_delayed': 0, 'avg_wait_time': 0} for company_id in company_ids}
+    for company_id, served, delayed, wait_seconds in rows:
+        stats[company_id] = {
+            'total_served': served,
+            'total_delayed': delayed,
+            'avg_wait_time': wait_seconds / served if served else 0
+        }
+    return stats
+
+def dashboard_companies(admin_id):
+    # Every dashboard card in one statement - each company of the admin with its
+    # cashier count, live queue totals and statistics, aggregated per company in
+    # subqueries limited to the admin's companies
+    owned = db.select(Company.id).where(Company.admin_id == admin_id)
+    cashiers = db.select(
+        Cashier.company_id,
+        db.func.count().label('cashiers'),
+        db.func.sum(db.case((Cashier.is_active.is_(True), 1), else_=0)).label('active_cashiers')
+    ).where(Cashier.company_id.in_(owned)).group_by(Cashier.company_id).subquery()
+    live = db.select(
+        Cashier.company_id,
+        db.func.sum(db.case((Customer.status == 'waiting', 1), else_=0)).label('waiting'),
+        db.func.sum(db.case((Customer.status == 'serving', 1), else_=0)).label('serving')
+    ).join(Customer, db.and_(
+        Customer.cashier_id == Cashier.id,
+        Customer.status.in_(['waiting', 'serving'])
+    )).where(Cashier.company_id.in_(owned)).group_by(Cashier.company_id).subquery()
+    stats = db.select(
+        QueueStats.company_id,
+        db.func.sum(QueueStats.served_count).label('served'),
+        db.func.sum(QueueStats.wait_seconds_total).label('wait_seconds')
+    ).where(QueueStats.company_id.in_(owned)).group_by(QueueStats.company_id).subquery()
     
-    return avg_serving_time
+    served = db.func.coalesce(stats.c.served, 0)
+    return db.session.execute(
+        db.select(
+            Company.id, Company.name, Company.service_type, Company.company_code, Company.created_at,
+            db.func.coalesce(cashiers.c.cashiers, 0).label('cashiers'),
+            db.func.coalesce(cashiers.c.active_cashiers, 0).label('active_cashiers'),
+            db.func.coalesce(live.c.waiting, 0).label('waiting'),
+            db.func.coalesce(live.c.serving, 0).label('serving'),
+            served.label('total_served'),
+            db.func.coalesce(stats.c.wait_seconds * 1.0 / db.func.nullif(served, 0), 0).label('avg_wait_time')
+        ).outerjoin(cashiers, cashiers.c.company_id == Company.id)
+        .outerjoin(live, live.c.company_id == Company.id)
+        .outerjoin(stats, stats.c.company_id == Company.id)
+        .where(Company.admin_id == admin_id)
+        .order_by(Company.id)
+    ).all()
+
+# Socket.IO rooms - every event is addressed to the rooms that need it instead of
+# being broadcast to every connected client of every company. Only the admin
+# pages hold Socket.IO connections; customers follow /api/stream
+def company_room(company_code):
+    return f'company_{company_code}'
+
+def admin_room(company_code):
+    return f'admin_{company_code}'
 
 def login_required(f):
     @wraps(f)
@@ -197,49 +1862,44 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Ownership checks - routes taking a cashier_id or customer_id are wrapped in
+# @owner_required (below @login_required), which answers 404 unless it exists
+# and 403 unless its company belongs to the logged-in admin. The cashier ->
+# company -> admin chain never changes, so it comes from the metadata cache, or
+# from one joined query on a miss; the route finds the cashier in g.cashier
+def customer_cashier_info(customer_id):
+    # Customers in a queue know their cashier; anyone else is resolved with the
+    # whole customer -> cashier -> company chain in one query
+    entry = queue_engine.find_by_id(customer_id)
+    if entry:
+        return cashier_info(entry.cashier_id)
+    row = db.session.query(Cashier, Company).join(Company, Company.id == Cashier.company_id).join(
+        Customer, Customer.cashier_id == Cashier.id
+    ).filter(Customer.id == customer_id).first()
+    return CashierInfo(*row) if row else None
+
+def owner_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'customer_id' in kwargs:
+            cashier = customer_cashier_info(kwargs['customer_id'])
+            not_found = 'Customer not found'
+        else:
+            cashier = cashier_info(kwargs['cashier_id'])
+            not_found = 'Cashier not found'
+        if cashier is None:
+            return jsonify({'error': not_found}), 404
+        if cashier.admin_id != int(session.get('admin_id')):
+            logger.warning(f"Unauthorized access to {request.path} by admin {session.get('admin_id')}")
+            return jsonify({'error': 'Unauthorized access'}), 403
+        g.cashier = cashier
+        return f(*args, **kwargs)
+    return decorated_function
+
 # Routes
 @app.route('/')
 def index():
-    # If user is logged in, redirect to dashboard - but provide alternate navigation
-    html = '''
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Virtual Queue System</title>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css" rel="stylesheet">
-    </head>
-    <body>
-        <div class="container mt-5">
-            <div class="jumbotron text-center">
-                <h1 class="display-4">Welcome to Virtual Queue System</h1>
-                <p class="lead">A smart solution for managing customer queues</p>
-                <hr class="my-4">
-            </div>
-            
-            <div class="row mt-5">
-                <div class="col-md-6 mx-auto">
-                    <div class="card">
-                        <div class="card-header">
-                            <h3>Choose an option</h3>
-                        </div>
-                        <div class="card-body">
-                            <div class="d-grid gap-3">
-                                <a href="/login" class="btn btn-primary btn-lg">Login</a>
-                                <a href="/register" class="btn btn-success btn-lg">Register</a>
-                                <a href="/admin" class="btn btn-info btn-lg">Admin Panel</a>
-                            </div>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </div>
-        <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/js/bootstrap.bundle.min.js"></script>
-    </body>
-    </html>
-    '''
-    return html
+    return render_template('index.html')
 
 @app.route('/health')
 def health():
@@ -328,59 +1988,11 @@ def logout():
 
 @app.route('/dashboard')
 @login_required
+@query_budget(1)
 def dashboard():
-    admin_id = session.get('admin_id')
-    companies = Company.query.filter_by(admin_id=admin_id).all()
-    
-    # Use a hardcoded template to avoid the create_company URL issue
-    html = '''
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Dashboard - Virtual Queue System</title>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css" rel="stylesheet">
-    </head>
-    <body>
-        <div class="container mt-5">
-            <div class="d-flex justify-content-between align-items-center mb-4">
-                <h1>Admin Dashboard</h1>
-                <a href="/create_company" class="btn btn-primary">Create New Company</a>
-            </div>
-            
-            {% if companies %}
-            <div class="row">
-                {% for company in companies %}
-                <div class="col-md-4 mb-4">
-                    <div class="card h-100">
-                        <div class="card-body">
-                            <h5 class="card-title">{{ company.name }}</h5>
-                            <p class="card-text text-muted">{{ company.service_type }}</p>
-                            <p><strong>Code:</strong> {{ company.company_code }}</p>
-                            <p><strong>Created:</strong> {{ company.created_at.strftime('%Y-%m-%d') }}</p>
-                            <p><strong>Cashiers:</strong> {{ company.cashiers|length }}</p>
-                        </div>
-                        <div class="card-footer bg-white border-top-0">
-                            <a href="/manage_company/{{ company.id }}" class="btn btn-primary w-100">Manage</a>
-                        </div>
-                    </div>
-                </div>
-                {% endfor %}
-            </div>
-            {% else %}
-            <div class="alert alert-info">
-                <p>You don't have any companies yet. Click the "Create New Company" button to get started.</p>
-            </div>
-            {% endif %}
-        </div>
-        <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/js/bootstrap.bundle.min.js"></script>
-    </body>
-    </html>
-    '''
-    
-    # Render the hardcoded template with the companies data
-    return render_template_string(html, companies=companies)
+    # The cards are standalone pages rather than base.html children, which
+    # cannot render (its navbar links to a 'home' endpoint that does not exist)
+    return render_template('dashboard.html', companies=dashboard_companies(session.get('admin_id')))
 
 @app.route('/create_company', methods=['GET', 'POST'])
 @login_required
@@ -417,6 +2029,8 @@ def create_company():
             db.session.add(cashier)
         
         db.session.commit()
+        # The code may have been looked up, and cached as unknown, before
+        invalidate_metadata(company_code)
         
         flash('Company created successfully.', 'success')
         return redirect(url_for('manage_company', company_id=company.id))
@@ -436,33 +2050,114 @@ def manage_company(company_id):
     cashiers = Cashier.query.filter_by(company_id=company_id).order_by(Cashier.cashier_number).all()
     
     # Get queue stats
-    stats = {
-        'total_served': QueueHistory.query.filter_by(company_id=company_id, status='served').count(),
-        'total_delayed': QueueHistory.query.filter_by(company_id=company_id).filter(QueueHistory.delays > 0).count(),
-        'avg_wait_time': 0
-    }
+    stats = company_stats([company_id])[company_id]
     
-    served_customers = QueueHistory.query.filter_by(company_id=company_id, status='served').all()
-    if served_customers:
-        total_wait_time = sum(c.wait_time_seconds or 0 for c in served_customers)
-        stats['avg_wait_time'] = total_wait_time / len(served_customers) if len(served_customers) > 0 else 0
-    
-    # Generate QR code
+    return render_template('manage_company.html', company=company, cashiers=cashiers, stats=stats)
+
+# QR codes - the image for a join URL never changes, so each one is rendered once
+# per process and served with a strong ETag and a long browser cache lifetime
+QR_CACHE_SIZE = int(os.getenv('QR_CACHE_SIZE', '256'))
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def render_qr_code(join_url):
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_L,
         box_size=10,
         border=4,
     )
-    qr.add_data(f"{request.host_url}join/{company.company_code}")
+    qr.add_data(join_url)
     qr.make(fit=True)
     
     img = qr.make_image(fill_color="black", back_color="white")
     buffered = BytesIO()
     img.save(buffered)
-    qr_code = base64.b64encode(buffered.getvalue()).decode('utf-8')
+    png = buffered.getvalue()
+    return png, hashlib.sha256(png).hexdigest()
+
+@app.route('/qr/<company_code>.png')
+def company_qr(company_code):
+    company = company_info(company_code)
+    if company is None:
+        abort(404)
+    png, etag = render_qr_code(f"{request.host_url}join/{company.company_code}")
     
-    return render_template('manage_company.html', company=company, cashiers=cashiers, stats=stats, qr_code=qr_code)
+    response = make_response(png)
+    response.mimetype = 'image/png'
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 31536000  # one year
+    return response.make_conditional(request)
+
+# History export - rows are read in keyset-paged batches, each in its own short
+# transaction, and written out as they arrive so memory stays flat and a long
+# download never holds a database connection or lock
+EXPORT_BATCH_SIZE = 1000
+EXPORT_COLUMNS = ['Cashier Number', 'OTP', 'Join Time', 'Served Time', 'Wait Time (s)', 'Status', 'Delays']
+
+def parse_export_date(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise ValueError(f"Invalid {name} date '{value}', expected YYYY-MM-DD")
+
+def iter_history_rows(filters):
+    last_id = 0
+    while True:
+        batch = db.session.query(
+            QueueHistory.id,
+            QueueHistory.cashier_number,
+            QueueHistory.otp,
+            QueueHistory.join_time,
+            QueueHistory.served_time,
+            QueueHistory.wait_time_seconds,
+            QueueHistory.status,
+            QueueHistory.delays
+        ).filter(QueueHistory.id > last_id, *filters).order_by(QueueHistory.id).limit(EXPORT_BATCH_SIZE).all()
+        db.session.commit()
+        
+        if not batch:
+            return
+        last_id = batch[-1].id
+        yield batch
+
+def generate_history_csv(filters, compress=False):
+    string_buffer = StringIO()
+    writer = csv.writer(string_buffer)
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 writes a gzip container
+    
+    def flush():
+        chunk = string_buffer.getvalue().encode('utf-8')
+        string_buffer.seek(0)
+        string_buffer.truncate()
+        return compressor.compress(chunk) if compressor else chunk
+    
+    writer.writerow(EXPORT_COLUMNS)
+    try:
+        for batch in iter_history_rows(filters):
+            for entry in batch:
+                writer.writerow([
+                    entry.cashier_number,
+                    entry.otp,
+                    entry.join_time.strftime('%Y-%m-%d %H:%M:%S'),
+                    entry.served_time.strftime('%Y-%m-%d %H:%M:%S') if entry.served_time else '',
+                    entry.wait_time_seconds or '',
+                    entry.status,
+                    entry.delays
+                ])
+            yield flush()
+    except Exception as e:
+        # Headers are already sent, so all we can do is cut the download short
+        logger.error(f"Error while streaming history export: {str(e)}")
+        logger.error(traceback.format_exc())
+        db.session.rollback()
+        raise
+    
+    chunk = flush()
+    yield chunk + compressor.flush() if compressor else chunk
 
 @app.route('/export/<int:company_id>')
 @login_required
@@ -473,31 +2168,33 @@ def export_history(company_id):
         if company.admin_id != session.get('admin_id'):
             flash("Unauthorized access", "danger")
             return redirect(url_for('dashboard'))
-
-        history = QueueHistory.query.filter_by(company_id=company_id).all()
-
-        # Create string buffer and write CSV data
-        string_buffer = StringIO()
-        writer = csv.writer(string_buffer)
-        writer.writerow(['Cashier Number', 'OTP', 'Join Time', 'Served Time', 'Wait Time (s)', 'Status', 'Delays'])
-
-        for entry in history:
-            writer.writerow([
-                entry.cashier_number,
-                entry.otp,
-                entry.join_time.strftime('%Y-%m-%d %H:%M:%S'),
-                entry.served_time.strftime('%Y-%m-%d %H:%M:%S') if entry.served_time else '',
-                entry.wait_time_seconds or '',
-                entry.status,
-                entry.delays
-            ])
-
-        # Get the string value and encode it to bytes
-        output = string_buffer.getvalue().encode('utf-8')
         
-        response = make_response(output)
-        response.headers['Content-Type'] = 'text/csv'
-        response.headers['Content-Disposition'] = f'attachment; filename=queue_history_{company_id}.csv'
+        # Optional filters: ?start=YYYY-MM-DD&end=YYYY-MM-DD (inclusive, by join
+        # time), ?cashier=<number> (repeatable) and ?gzip=1 for a .csv.gz file
+        try:
+            start = parse_export_date('start')
+            end = parse_export_date('end')
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            cashier_numbers = [int(number) for number in request.args.getlist('cashier') if number]
+        except ValueError:
+            return jsonify({'error': 'cashier must be a cashier number'}), 400
+        
+        filters = [QueueHistory.company_id == company_id]
+        if start:
+            filters.append(QueueHistory.join_time >= start)
+        if end:
+            filters.append(QueueHistory.join_time < end + timedelta(days=1))
+        if cashier_numbers:
+            filters.append(QueueHistory.cashier_number.in_(cashier_numbers))
+        
+        compress = request.args.get('gzip') in ('1', 'true')
+        filename = f'queue_history_{company_id}.csv.gz' if compress else f'queue_history_{company_id}.csv'
+        
+        response = Response(stream_with_context(generate_history_csv(filters, compress)),
+                            mimetype='application/gzip' if compress else 'text/csv')
+        response.headers['Content-Disposition'] = f'attachment; filename={filename}'
         return response
         
     except Exception as e:
@@ -505,13 +2202,35 @@ def export_history(company_id):
         logger.error(traceback.format_exc())
         return jsonify({"error": "Internal Server Error", "details": str(e)}), 500
 
+@app.route('/api/company_stats/<int:company_id>')
+@login_required
+@query_budget(5)
+def get_company_stats(company_id):
+    company = Company.query.get_or_404(company_id)
+    if company.admin_id != session.get('admin_id'):
+        return jsonify({'error': 'Unauthorized access'}), 403
+    
+    cashiers = QueueStats.query.filter_by(company_id=company_id).order_by(QueueStats.cashier_number).all()
+    return jsonify({
+        **company_stats([company_id])[company_id],
+        'cashiers': [{
+            'cashier_number': cashier.cashier_number,
+            'total_served': cashier.served_count,
+            'total_removed': cashier.removed_count,
+            'total_delayed': cashier.delayed_count,
+            'avg_wait_time': cashier.wait_seconds_total / cashier.served_count if cashier.served_count else 0
+        } for cashier in cashiers]
+    })
+
 @app.route('/api/get_cashier_queue/<int:cashier_id>')
 @login_required
+@owner_required
+@query_budget(1)
 def get_cashier_queue(cashier_id):
     try:
         # Check if cashier exists
-        cashier = Cashier.query.get(cashier_id)
-        if not cashier:
+        queue = queue_engine.get_cashier(cashier_id)
+        if not queue:
             logger.warning(f"Cashier with ID {cashier_id} not found")
             return jsonify({
                 'error': 'Cashier not found',
@@ -520,26 +2239,18 @@ def get_cashier_queue(cashier_id):
                 'queue': []
             }), 404
         
-        # Check if admin owns this company
-        company = Company.query.get(cashier.company_id)
-        if not company or company.admin_id != int(session.get('admin_id')):
-            logger.warning(f"Unauthorized access to cashier {cashier_id}")
-            return jsonify({'error': 'Unauthorized access'}), 403
-        
-        # Only get active customers (waiting or serving)
-        customers = Customer.query.filter_by(cashier_id=cashier_id).filter(
-            Customer.status.in_(['waiting', 'serving'])
-        ).order_by(Customer.position).all()
-        
+        # Active customers (waiting or serving) come from the queue engine, the serving one first
+        service_seconds = queue_engine.service_time(queue)
         queue_data = []
-        for customer in customers:
+        for customer in queue.ordered():
             # Calculate estimated wait time
-            position = customer.position
-            estimated_wait_time = int(position * calculate_wait_time(cashier_id))
+            position = queue.position(customer)
+            estimated_wait_time = int(position * service_seconds)
             
             queue_data.append({
                 'id': customer.id,
                 'otp': customer.otp,
+                'ticket': customer.ticket,
                 'position': position,
                 'status': customer.status,
                 'delays': customer.delays,
@@ -549,8 +2260,9 @@ def get_cashier_queue(cashier_id):
             })
         
         return jsonify({
-            'cashier_number': cashier.cashier_number,
-            'is_active': cashier.is_active,
+            'cashier_number': queue.cashier_number,
+            'is_active': queue.is_active,
+            'service_seconds': service_seconds,
             'queue': queue_data
         })
     except Exception as e:
@@ -564,41 +2276,82 @@ def get_cashier_queue(cashier_id):
 
 @app.route('/api/toggle_cashier/<int:cashier_id>', methods=['POST'])
 @login_required
+@owner_required
+@query_budget(2)
 def toggle_cashier(cashier_id):
-    cashier = Cashier.query.get_or_404(cashier_id)
+    # Toggle cashier active status in the database, which may have been changed
+    # by another worker since the cached copy was read
+    is_active = db.session.execute(
+        db.update(Cashier).where(Cashier.id == cashier_id).values(is_active=db.not_(Cashier.is_active)).returning(Cashier.is_active)
+    ).scalar_one()
+    db.session.commit()
+    queue_engine.update_cashier(cashier_id, is_active)
+    company_code = g.cashier.company_code
+    invalidate_metadata(company_code, [cashier_id])
     
-    # Check if admin owns this company
-    company = Company.query.get(cashier.company_id)
-    if company.admin_id != int(session.get('admin_id')):
-        return jsonify({'error': 'Unauthorized access'}), 403
+    # Emit socket event to notify everyone following this company
+    socketio.emit('cashier_status_change', {
+        'cashier_id': cashier_id,
+        'is_active': is_active,
+        'company_code': company_code
+    }, to=company_room(company_code))
     
-    # Toggle cashier active status
-    cashier.is_active = not cashier.is_active
-    db.session.commit()
+    return jsonify({'success': True, 'is_active': is_active})
+
+@app.route('/api/close_cashier/<int:cashier_id>', methods=['POST'])
+@login_required
+@owner_required
+def close_cashier(cashier_id):
+    # Like deactivating with toggle_cashier, but the waiting customers are moved
+    # to the other active cashiers instead of being left behind
+    queue = queue_engine.get_cashier(cashier_id)
+    if queue is None:
+        return jsonify({'error': 'Cashier not found'}), 404
+    if not queue.is_active:
+        return jsonify({'error': 'Cashier is already inactive'}), 400
+    
+    targets, _, moved = queue_engine.close_cashier(queue)
+    if targets is None:
+        return jsonify({'error': 'No other active cashier to move customers to'}), 400
+    invalidate_metadata(queue.company_code, [cashier_id])
+    
+    # Admins get one diff per queue; moved customers' streams name their new cashier
+    event_coalescer.queue_updated(queue)
+    for target in targets:
+        event_coalescer.queue_updated(target)
     
-    # Emit socket event to notify all clients
     socketio.emit('cashier_status_change', {
         'cashier_id': cashier_id,
-        'is_active': cashier.is_active,
-        'company_code': company.company_code
-    })
+        'is_active': False,
+        'company_code': queue.company_code
+    }, to=company_room(queue.company_code))
     
-    return jsonify({'success': True, 'is_active': cashier.is_active})
+    return jsonify({
+        'success': True,
+        'is_active': False,
+        'moved': moved,
+        'cashiers': sorted(target.cashier_number for target in targets)
+    })
 
 @app.route('/queue_status/<otp>')
 def queue_status(otp):
-    customer = Customer.query.filter_by(otp=otp).first_or_404()
-    cashier = Cashier.query.get(customer.cashier_id)
-    company = Company.query.get(cashier.company_id)
+    found = find_customer(otp)
+    if found is None:
+        abort(404)
+    customer, cashier, company_code, position = found
+    company = company_info(company_code)
     
-    # Calculate estimated wait time
-    estimated_wait_seconds = customer.position * calculate_wait_time(cashier.id)
+    # Calculate estimated wait time - only for active customers
+    estimated_wait_seconds = 0
+    if customer.status in ['waiting', 'serving']:
+        estimated_wait_seconds = position * queue_engine.service_time(cashier)
     
     response = app.make_response(render_template(
         'queue_status.html',
         customer=customer,
         cashier=cashier,
         company=company,
+        position=position,
         estimated_wait_seconds=estimated_wait_seconds
     ))
     
@@ -609,362 +2362,260 @@ def queue_status(otp):
     
     return response
 
+# Status polling - responses carry an ETag over the customer's state so an
+# unchanged poll costs a 304, and ?wait=N holds the request open (up to
+# LONG_POLL_MAX_SECONDS) until that state changes
+LONG_POLL_MAX_SECONDS = 30
+
+def customer_status(otp):
+    # For served or removed customers, position is 0
+    found = find_customer(otp)
+    if found is None:
+        return None
+    customer, cashier, company_code, position = found
+    
+    # Calculate estimated wait time - only for active customers
+    estimated_wait_seconds = 0
+    if customer.status in ['waiting', 'serving']:
+        estimated_wait_seconds = position * queue_engine.service_time(cashier)
+    
+    state = (customer.status, position, cashier.cashier_number, cashier.is_active,
+             estimated_wait_seconds, customer.delays, customer.serving_start_time)
+    etag = hashlib.sha1(repr(state).encode('utf-8')).hexdigest()
+    return customer, cashier, company_code, position, estimated_wait_seconds, etag
+
+def status_payload(customer, cashier, company_code, position, estimated_wait_seconds):
+    # Calculate time since serving started (if applicable)
+    serving_time_passed = None
+    if customer.serving_start_time:
+        serving_time_passed = (datetime.utcnow() - customer.serving_start_time).total_seconds()
+    
+    return {
+        'position': position,
+        'status': customer.status,
+        'cashier_number': cashier.cashier_number,
+        'cashier_is_active': cashier.is_active,
+        'estimated_wait_seconds': estimated_wait_seconds,
+        'serving_time_passed': serving_time_passed,
+        'delays': customer.delays,
+        'company_code': company_code,
+        'last_update_time': datetime.utcnow().isoformat(),
+        'join_time': customer.join_time.isoformat() if customer.join_time else None,
+        'served_time': customer.served_time.isoformat() if customer.served_time else None
+    }
+
 @app.route('/api/check_status/<otp>')
+@query_budget(2)
 def check_status(otp):
     try:
-        customer = Customer.query.filter_by(otp=otp).first_or_404()
-        cashier = Cashier.query.get(customer.cashier_id)
-        company = Company.query.get(cashier.company_id)
-        
-        # Calculate estimated wait time - only for active customers
-        estimated_wait_seconds = 0
-        if customer.status in ['waiting', 'serving']:
-            estimated_wait_seconds = customer.position * calculate_wait_time(cashier.id)
-        
-        # Calculate time since serving started (if applicable)
-        serving_time_passed = None
-        if customer.serving_start_time:
-            serving_time_passed = (datetime.utcnow() - customer.serving_start_time).total_seconds()
-        
-        # For served or removed customers, return 0 as position
-        position = customer.position if customer.status in ['waiting', 'serving'] else 0
-        
-        response = jsonify({
-            'position': position,
-            'status': customer.status,
-            'cashier_number': cashier.cashier_number,
-            'cashier_is_active': cashier.is_active,
-            'estimated_wait_seconds': estimated_wait_seconds,
-            'serving_time_passed': serving_time_passed,
-            'delays': customer.delays,
-            'company_code': company.company_code,
-            'last_update_time': datetime.utcnow().isoformat(),
-            'join_time': customer.join_time.isoformat() if customer.join_time else None,
-            'served_time': customer.served_time.isoformat() if customer.served_time else None
-        })
-        
-        # Set cache headers
-        response.headers['Cache-Control'] = 'no-cache, no-store, must-revalidate'
-        response.headers['Pragma'] = 'no-cache'
-        response.headers['Expires'] = '0'
+        wait = max(0, min(request.args.get('wait', 0, type=float), LONG_POLL_MAX_SECONDS))
+        deadline = time.monotonic() + wait
+        state = customer_status(otp)
+        while True:
+            if state is None:
+                return jsonify({'error': 'Unknown OTP'}), 404
+            customer, cashier, company_code, position, estimated_wait_seconds, etag = state
+            remaining = deadline - time.monotonic()
+            if not request.if_none_match.contains_weak(etag) or remaining <= 0:
+                break
+
+            # Give the connection back to the pool while parked, or a few idle
+            # status pages could hold every connection
+            db.session.commit()
+            db.session.remove()
+            if not isinstance(cashier, CashierQueue):
+                # Finished customers never change again
+                socketio.sleep(remaining)
+            else:
+                # Other workers do not wake us, so look again once the engine
+                # would have reloaded the queue
+                cashier.changed.wait(min(remaining, queue_engine.ttl) if queue_engine.ttl > 0 else remaining)
+            with app.app_context():
+                state = customer_status(otp)
+
+        if request.if_none_match.contains_weak(etag):
+            response = make_response('', 304)
+        else:
+            response = jsonify(status_payload(customer, cashier, company_code, position, estimated_wait_seconds))
         
+        # Let clients keep the response but always revalidate it
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
         return response
     except Exception as e:
         logger.error(f"Error checking status for OTP {otp}: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'error': 'Could not retrieve status information'}), 500
 
+# Status stream - Server-Sent Events for one OTP, which the status page uses
+# instead of a Socket.IO connection. Every change to the customer's status,
+# position or estimate is sent as a `status` event with the check_status payload,
+# and a comment line every SSE_HEARTBEAT_SECONDS keeps proxies from closing an
+# idle stream. Each stream is a greenlet waiting on its cashier's change event;
+# it holds no request context or database connection while idle. The stream
+# ends after the event that reports the customer served or removed.
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_RETRY_MS = 3000
+
+@app.route('/api/stream/<otp>')
+def stream_status(otp):
+    state = customer_status(otp)
+    if state is None:
+        return jsonify({'error': 'Unknown OTP'}), 404
+    
+    def events(state):
+        metrics.streams += 1
+        try:
+            yield f'retry: {SSE_RETRY_MS}\n\n'
+            etag = None
+            written = time.monotonic()
+            while True:
+                customer, cashier, company_code, position, estimated_wait_seconds, new_etag = state
+                # Taken before yielding, so a change while the event is written
+                # still wakes the wait below
+                changed = cashier.changed if isinstance(cashier, CashierQueue) else None
+                if new_etag != etag:
+                    etag = new_etag
+                    data = json.dumps(status_payload(customer, cashier, company_code, position, estimated_wait_seconds))
+                    yield f'event: status\ndata: {data}\n\n'
+                    written = time.monotonic()
+                elif time.monotonic() - written >= SSE_HEARTBEAT_SECONDS:
+                    yield ': heartbeat\n\n'
+                    written = time.monotonic()
+                if changed is None:
+                    return
+                
+                # Other workers do not wake us, so look again once the engine
+                # would have reloaded the queue
+                timeout = max(0, SSE_HEARTBEAT_SECONDS - (time.monotonic() - written))
+                changed.wait(min(timeout, queue_engine.ttl) if queue_engine.ttl > 0 else timeout)
+                with app.app_context():
+                    state = customer_status(otp)
+                if state is None:
+                    return
+        finally:
+            metrics.streams -= 1
+    
+    response = Response(events(state), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # nginx would otherwise buffer the stream
+    return response
+
 @app.route('/join/<company_code>')
 def join_queue_page(company_code):
-    company = Company.query.filter_by(company_code=company_code).first_or_404()
-    cashiers = Cashier.query.filter_by(company_id=company.id, is_active=True).all()
+    company = company_info(company_code)
+    if company is None:
+        abort(404)
+    cashiers = [cashier for cashier in company.cashiers if cashier.is_active]
     
     return render_template('join_queue.html', company=company, cashiers=cashiers)
 
 @app.route('/api/join_queue/<company_code>', methods=['POST'])
 def join_queue(company_code):
-    company = Company.query.filter_by(company_code=company_code).first_or_404()
-    
-    # Find the cashier with the shortest queue
-    cashiers = Cashier.query.filter_by(company_id=company.id, is_active=True).all()
-    
-    if not cashiers:
-        return jsonify({'error': 'No active cashiers available'}), 400
-    
-    shortest_queue_cashier = None
-    min_queue_length = float('inf')
-    
-    for cashier in cashiers:
-        queue_length = Customer.query.filter_by(
-            cashier_id=cashier.id, 
-            status='waiting'
-        ).count()
-        
-        if queue_length < min_queue_length:
-            min_queue_length = queue_length
-            shortest_queue_cashier = cashier
+    # Unknown codes never take an OTP, so they cannot use up the OTP space
+    company = company_info(company_code)
+    if company is None:
+        abort(404)
+    # Hand the connection back first: reserving the allocator's next block needs
+    # a pooled connection, which requests waiting on the allocator may be holding
+    db.session.commit()
+    otp = otp_allocator.allocate()
     
-    # Generate OTP
-    while True:
-        otp = generate_otp()
-        if not Customer.query.filter_by(otp=otp).first():
+    # Add the customer to the cashier with the shortest queue - the new ticket
+    # goes behind every waiting customer
+    for attempt in range(3):
+        try:
+            shortest_queue, customer = queue_engine.join(company.id, otp)
             break
+        except IntegrityError:
+            # Only customers who joined before the allocator was introduced
+            # can hold an OTP it hands out
+            db.session.rollback()
+            if attempt == 2:
+                raise
+            otp = otp_allocator.allocate()
     
-    # Calculate position
-    position = min_queue_length + 1
-    
-    # Verify no position conflicts
-    existing_position = Customer.query.filter_by(
-        cashier_id=shortest_queue_cashier.id,
-        position=position
-    ).first()
-    
-    if existing_position:
-        # Fix position sequence before adding new customer
-        logger.warning(f"Position conflict detected at position {position} for cashier {shortest_queue_cashier.id}. Fixing positions.")
-        customers_to_reorder = Customer.query.filter_by(
-            cashier_id=shortest_queue_cashier.id,
-            status='waiting'
-        ).order_by(Customer.join_time).all()
-        
-        # Reorder all waiting customers by join time
-        for i, cust in enumerate(customers_to_reorder, 1):
-            cust.position = i
-        
-        db.session.commit()
-        
-        # Recalculate position after fixing
-        position = Customer.query.filter_by(
-            cashier_id=shortest_queue_cashier.id, 
-            status='waiting'
-        ).count() + 1
-    
-    # Create customer in queue
-    customer = Customer(
-        cashier_id=shortest_queue_cashier.id,
-        otp=otp,
-        position=position,
-        status='waiting'  # Explicitly set status to waiting
-    )
-    
-    db.session.add(customer)
+    if not shortest_queue:
+        return jsonify({'error': 'No active cashiers available'}), 400
     
-    # Check if any other customers are incorrectly marked as serving
-    serving_customers = Customer.query.filter_by(
-        cashier_id=shortest_queue_cashier.id,
-        status='serving'
-    ).all()
+    position = shortest_queue.position(customer)
     
-    if len(serving_customers) > 1:
-        # More than one customer is marked as serving - fix this issue
-        logger.warning(f"Multiple serving customers detected for cashier {shortest_queue_cashier.id}. Found {len(serving_customers)} serving customers.")
-        
-        # Sort by join time to keep the oldest one as serving
-        serving_customers.sort(key=lambda x: x.join_time)
-        
-        # Mark all except the first one as waiting
-        for i, cust in enumerate(serving_customers):
-            if i > 0:  # Skip the first (oldest) one
-                logger.info(f"Fixing customer {cust.otp} status from 'serving' to 'waiting'")
-                cust.status = 'waiting'
-                cust.serving_start_time = None
-                
-                # Ensure no duplicate positions
-                if cust.position == 1:
-                    # Find highest position number
-                    max_position = db.session.query(db.func.max(Customer.position)).filter(
-                        Customer.cashier_id == shortest_queue_cashier.id,
-                        Customer.status == 'waiting'
-                    ).scalar() or 1
-                    
-                    cust.position = max_position + 1
-                    logger.info(f"Fixed position for customer {cust.otp} from 1 to {cust.position}")
-    
-    # If this is the first customer for this cashier, mark as serving
-    if position == 1 and not serving_customers:
-        customer.status = 'serving'
-        customer.serving_start_time = datetime.utcnow()
-        
-        # Emit socket event to notify the customer
-        socketio.emit('customer_turn', {
-            'otp': customer.otp,
-            'cashier_number': shortest_queue_cashier.cashier_number,
-            'company_code': company.company_code
-        })
-    
-    # Final commit to save all changes
-    db.session.commit()
+    event_coalescer.queue_updated(shortest_queue)
     
     # Calculate estimated wait time
-    estimated_wait_seconds = position * calculate_wait_time(shortest_queue_cashier.id)
+    estimated_wait_seconds = position * queue_engine.service_time(shortest_queue)
     
     return jsonify({
         'success': True,
-        'otp': otp,
+        'otp': customer.otp,
         'position': position,
         'status': customer.status,  # Include status in response
-        'cashier_number': shortest_queue_cashier.cashier_number,
+        'cashier_number': shortest_queue.cashier_number,
         'estimated_wait_seconds': estimated_wait_seconds
     })
 
+# SQL profiles of recent requests (SQL_PROFILE=1 only), newest first.
+# ?endpoint=<name> narrows the list, ?flagged=1 keeps requests over budget or
+# with a repeated statement
+@app.route('/debug/queries')
+@login_required
+def debug_queries():
+    if not SQL_PROFILE:
+        return jsonify({'error': 'SQL profiling is disabled, set SQL_PROFILE=1'}), 404
+
+    endpoint = request.args.get('endpoint')
+    flagged = request.args.get('flagged') == '1'
+    profiles = list(sql_profiles)
+
+    routes = {}
+    for profile in profiles:
+        route = routes.setdefault(profile['endpoint'], {
+            'requests': 0, 'queries_max': 0, 'queries_total': 0,
+            'budget': profile['budget'], 'over_budget': 0, 'repeated': 0
+        })
+        route['requests'] += 1
+        route['queries_total'] += profile['queries']
+        route['queries_max'] = max(route['queries_max'], profile['queries'])
+        route['over_budget'] += 1 if profile['over_budget'] else 0
+        route['repeated'] += 1 if profile['repeated'] else 0
+
+    requests = [profile for profile in reversed(profiles)
+                if (endpoint is None or profile['endpoint'] == endpoint)
+                and (not flagged or profile['over_budget'] or profile['repeated'])]
+    return jsonify({
+        'default_budget': DEFAULT_QUERY_BUDGET,
+        'n_plus_one_threshold': N_PLUS_ONE_THRESHOLD,
+        'routes': routes,
+        'requests': requests
+    })
+
 # Add a standalone admin panel route
 @app.route('/admin')
 def admin_panel():
-    html = '''
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Admin Panel - Virtual Queue</title>
-        <link href="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css" rel="stylesheet">
-    </head>
-    <body>
-        <div class="container mt-5">
-            <div class="row">
-                <div class="col-12 mb-4">
-                    <h1>Virtual Queue Admin Panel</h1>
-                    <div class="alert alert-success">
-                        This is a standalone page that doesn't depend on other routes
-                    </div>
-                </div>
-                
-                <div class="col-md-6">
-                    <div class="card mb-4">
-                        <div class="card-header">
-                            Authentication
-                        </div>
-                        <div class="card-body">
-                            <div class="list-group">
-                                <a href="/login" class="list-group-item list-group-item-action">Login</a>
-                                <a href="/register" class="list-group-item list-group-item-action">Register</a>
-                                <a href="/logout" class="list-group-item list-group-item-action">Logout</a>
-                            </div>
-                        </div>
-                    </div>
-                </div>
-                
-                <div class="col-md-6">
-                    <div class="card mb-4">
-                        <div class="card-header">
-                            Test Pages
-                        </div>
-                        <div class="card-body">
-                            <div class="list-group">
-                                <a href="/api/health" class="list-group-item list-group-item-action">API Health</a>
-                                <a href="/test" class="list-group-item list-group-item-action">Test Endpoint</a>
-                            </div>
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </div>
-        <script src="https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/js/bootstrap.bundle.min.js"></script>
-    </body>
-    </html>
-    '''
-    return html
+    return render_template('admin_panel.html')
 
 # Basic route for testing
 @app.route('/test')
 def test():
     return jsonify({"message": "Test endpoint working!", "environment": dict(os.environ)}), 200
 
-# Function to update positions for customers in a queue
-def update_customer_positions(cashier_id, start_position):
-    try:
-        # Add transactions for safety
-        customers_to_update = Customer.query.filter_by(
-            cashier_id=cashier_id, 
-            status='waiting'
-        ).filter(Customer.position > start_position).order_by(Customer.position).all()
-        
-        for customer in customers_to_update:
-            old_position = customer.position
-            customer.position -= 1
-            logger.info(f"Updated customer {customer.otp} position from {old_position} to {customer.position}")
-        
-        db.session.commit()
-        
-        # Emit more detailed data for debugging
-        socketio.emit('queue_updated', {
-            'cashier_id': cashier_id, 
-            'updated_count': len(customers_to_update),
-            'timestamp': datetime.utcnow().isoformat()
-        })
-        
-        return customers_to_update
-    except Exception as e:
-        logger.error(f"Error updating positions: {str(e)}")
-        db.session.rollback()  # Important to roll back on error
-        return []
-
 @app.route('/api/serve_customer/<int:cashier_id>', methods=['POST'])
 def serve_customer(cashier_id):
     try:
-        cashier = Cashier.query.get_or_404(cashier_id)
+        queue = queue_engine.get_cashier(cashier_id)
+        if not queue:
+            return jsonify({'error': 'Cashier not found'}), 404
         
-        # Handle currently serving customers first
-        already_serving = Customer.query.filter_by(cashier_id=cashier_id, status='serving').all()
+        # Finish the customer at the counter and call the lowest ticket - everyone
+        # behind moves up without being touched
+        _, next_customer = queue_engine.serve(queue)
         
-        for customer in already_serving:
-            customer.status = 'served'
-            customer.served_time = datetime.utcnow()
-            customer.position = 0  # Reset position when served
-            logger.info(f"Marking customer {customer.otp} as served and setting position to 0")
-            
-            # Add to history - consider moving this to a function
-            wait_time_seconds = int((customer.served_time - customer.join_time).total_seconds())
-            history = QueueHistory(
-                company_id=cashier.company_id,
-                cashier_number=cashier.cashier_number,
-                otp=customer.otp,
-                join_time=customer.join_time,
-                served_time=customer.served_time,
-                wait_time_seconds=wait_time_seconds,
-                status='served',
-                delays=customer.delays
-            )
-            db.session.add(history)
-        
-        # Commit these changes before finding the next customer
-        db.session.commit()
-        
-        # Process next customer - find the one with the lowest position
-        next_customer = Customer.query.filter_by(
-            cashier_id=cashier_id,
-            status='waiting'
-        ).order_by(Customer.position).first()
+        # Push the new queue to admins; customers' streams see the change themselves
+        event_coalescer.queue_updated(queue)
         
         if not next_customer:
             return jsonify({'message': 'No customers waiting in queue'}), 200
         
-        # Update next customer
-        logger.info(f"Setting customer {next_customer.otp} as serving with position 1")
-        next_customer.status = 'serving'
-        next_customer.serving_start_time = datetime.utcnow()
-        old_position = next_customer.position
-        next_customer.position = 1  # Ensure position is 1
-        
-        # Update positions if needed
-        if old_position > 1:
-            update_customer_positions(cashier_id, old_position)
-        
-        # Check for any duplicate serving customers (safety check)
-        duplicate_serving = Customer.query.filter_by(
-            cashier_id=cashier_id,
-            status='serving'
-        ).filter(Customer.id != next_customer.id).all()
-        
-        if duplicate_serving:
-            logger.warning(f"Found {len(duplicate_serving)} duplicate serving customers during serve operation. Fixing...")
-            for cust in duplicate_serving:
-                cust.status = 'waiting'
-                cust.serving_start_time = None
-                # Move to end of queue
-                max_position = db.session.query(db.func.max(Customer.position)).filter(
-                    Customer.cashier_id == cashier_id,
-                    Customer.status == 'waiting'
-                ).scalar() or 1
-                cust.position = max_position + 1
-                logger.info(f"Fixed duplicate serving customer {cust.otp}, moved to position {cust.position}")
-        
-        db.session.commit()
-        
-        # Emit events
-        socketio.emit('customer_turn', {
-            'otp': next_customer.otp,
-            'cashier_number': cashier.cashier_number,
-            'company_code': cashier.company.company_code
-        })
-        
-        # Emit queue update event to refresh all clients
-        socketio.emit('queue_updated', {
-            'cashier_id': cashier_id,
-            'company_code': cashier.company.company_code,
-            'timestamp': datetime.utcnow().isoformat()
-        })
-        
         return jsonify({
             'message': 'Customer now being served',
             'otp': next_customer.otp
@@ -976,174 +2627,53 @@ def serve_customer(cashier_id):
 
 @app.route('/api/remove_customer/<int:customer_id>', methods=['POST'])
 @login_required
+@owner_required
+@query_budget(4)
 def remove_customer(customer_id):
-    customer = Customer.query.get_or_404(customer_id)
-    cashier = Cashier.query.get(customer.cashier_id)
-    
-    # Check if admin owns this company
-    company = Company.query.get(cashier.company_id)
-    if company.admin_id != int(session.get('admin_id')):
-        return jsonify({'error': 'Unauthorized access'}), 403
+    customer = queue_engine.find_by_id(customer_id)
+    if not customer:
+        return jsonify({'error': 'Customer is no longer in the queue'}), 400
+    queue = queue_engine.cashiers[customer.cashier_id]
     
-    # Record in history before removing
-    history_entry = QueueHistory(
-        company_id=company.id,
-        cashier_number=cashier.cashier_number,
-        otp=customer.otp,
-        join_time=customer.join_time,
-        served_time=datetime.utcnow(),
-        wait_time_seconds=int((datetime.utcnow() - customer.join_time).total_seconds()),
-        status='removed',
-        delays=customer.delays
-    )
-    db.session.add(history_entry)
-    
-    # Store position before updating customer
-    old_position = customer.position
-    logger.info(f"Removing customer {customer.otp} with position {old_position}")
-    was_serving = customer.status == 'serving'
+    # Record in history and remove; if they were being served the next customer is called
+    try:
+        customer, next_customer = queue_engine.remove(customer)
+    except LookupError:
+        # Served or removed by another worker since the lookup
+        return jsonify({'error': 'Customer is no longer in the queue'}), 400
     
-    # Update customer status
-    customer.status = 'removed'
+    if next_customer:
+        logger.info(f"Marking next customer {next_customer.otp} as serving")
     
-    # Commit the status change
-    db.session.commit()
-    
-    # Update positions for waiting customers behind this one
-    updated_customers = update_customer_positions(customer.cashier_id, old_position)
-    logger.info(f"Updated positions for {len(updated_customers)} customers")
-    
-    # If the removed customer was being served, start serving the next customer
-    if was_serving:
-        next_customer = Customer.query.filter_by(
-            cashier_id=cashier.id,
-            status='waiting',
-            position=1
-        ).first()
-        
-        if next_customer:
-            logger.info(f"Marking next customer {next_customer.otp} as serving")
-            next_customer.status = 'serving'
-            next_customer.serving_start_time = datetime.utcnow()
-            db.session.commit()
-            
-            # Emit socket event to notify the next customer
-            socketio.emit('customer_turn', {
-                'otp': next_customer.otp,
-                'cashier_number': cashier.cashier_number,
-                'company_code': company.company_code
-            })
-    
-    # Also emit an event to the removed customer
-    socketio.emit('customer_removed', {
-        'otp': customer.otp,
-        'cashier_number': cashier.cashier_number,
-        'company_code': company.company_code
-    })
+    # Customers behind the removed one have moved up
+    event_coalescer.queue_updated(queue)
     
     return jsonify({'success': True, 'message': 'Customer removed from queue'})
 
 @app.route('/api/delay_customer/<int:customer_id>', methods=['POST'])
 @login_required
+@owner_required
+@query_budget(4)
 def delay_customer(customer_id):
     try:
-        customer = Customer.query.get_or_404(customer_id)
-        cashier = Cashier.query.get(customer.cashier_id)
-        
-        # Check if admin owns this company
-        company = Company.query.get(cashier.company_id)
-        if company.admin_id != int(session.get('admin_id')):
-            return jsonify({'error': 'Unauthorized access'}), 403
+        customer = queue_engine.find_by_id(customer_id)
+        if not customer:
+            return jsonify({'error': 'Only currently serving customers can be delayed'}), 400
+        queue = queue_engine.cashiers[customer.cashier_id]
         
         # Only allow delaying customers who are currently serving
         if customer.status != 'serving':
             return jsonify({'error': 'Only currently serving customers can be delayed'}), 400
         
-        # Increment delay count
-        customer.delays += 1
-        logger.info(f"Customer {customer.otp} delayed, delay count now: {customer.delays}")
-        
-        # Check if this is the third delay (delays now equals 3)
-        if customer.delays >= 3:
-            # If delayed 3 times, remove the customer
-            logger.info(f"Customer {customer.otp} has been delayed 3 times, removing from queue")
-            customer.status = 'removed'
-            
-            # Record in history
-            history_entry = QueueHistory(
-                company_id=company.id,
-                cashier_number=cashier.cashier_number,
-                otp=customer.otp,
-                join_time=customer.join_time,
-                served_time=datetime.utcnow(),
-                wait_time_seconds=int((datetime.utcnow() - customer.join_time).total_seconds()),
-                status='removed',
-                delays=customer.delays
-            )
-            db.session.add(history_entry)
-            
-            # Emit socket event to notify the customer about removal
-            socketio.emit('customer_removed', {
-                'otp': customer.otp,
-                'cashier_number': cashier.cashier_number,
-                'company_code': company.company_code,
-                'reason': 'Maximum delays reached'
-            })
-        else:
-            # Update customer status and reset serving start time
-            customer.status = 'waiting'
-            customer.serving_start_time = None
-            
-            # Move the delayed customer to the end of the waiting queue
-            max_position = db.session.query(db.func.max(Customer.position)).filter(
-                Customer.cashier_id == cashier.id,
-                Customer.status == 'waiting'
-            ).scalar() or 0
-            
-            # Position at the end of the queue
-            if max_position > 0:
-                customer.position = max_position + 1
-                
-            # Emit socket event to notify all clients
-            socketio.emit('customer_delayed', {
-                'otp': customer.otp,
-                'cashier_number': cashier.cashier_number,
-                'company_code': company.company_code,
-                'new_position': customer.position,
-                'delays': customer.delays
-            })
-        
-        # Commit changes before finding next customer
-        db.session.commit()
-        
-        # Find the next waiting customer for this cashier - the one with lowest position
-        next_customer = Customer.query.filter_by(
-            cashier_id=cashier.id,
-            status='waiting'
-        ).order_by(Customer.position).first()
+        # Move them to the back of the queue (or remove them on the third delay)
+        # and serve the next customer
+        try:
+            customer, next_customer = queue_engine.delay(customer)
+        except LookupError:
+            # Served or removed by another worker since the lookup
+            return jsonify({'error': 'Customer is no longer in the queue'}), 400
         
-        # Always serve the next customer if available
-        if next_customer:
-            logger.info(f"Setting next customer {next_customer.otp} as serving")
-            
-            # Ensure the next customer is in position 1
-            old_position = next_customer.position
-            next_customer.position = 1
-            next_customer.status = 'serving'
-            next_customer.serving_start_time = datetime.utcnow()
-            
-            # Update other positions if needed
-            if old_position > 1:
-                update_customer_positions(cashier.id, old_position)
-                
-            db.session.commit()
-            
-            # Emit socket event to notify the next customer
-            socketio.emit('customer_turn', {
-                'otp': next_customer.otp,
-                'cashier_number': cashier.cashier_number,
-                'company_code': company.company_code
-            })
+        event_coalescer.queue_updated(queue)
         
         return jsonify({'success': True, 'message': 'Customer delayed or removed'})
     
@@ -1152,6 +2682,96 @@ def delay_customer(customer_id):
         logger.error(f"Error delaying customer: {str(e)}")
         return jsonify({'error': 'An error occurred while delaying customer'}), 500
 
+# Bulk queue operations - each request is one transaction with bulk writes to
+# Customer and QueueHistory, and admins get the usual coalesced queue update
+BULK_MAX_CUSTOMERS = 1000
+
+@app.route('/api/bulk/serve/<int:cashier_id>', methods=['POST'])
+@login_required
+@owner_required
+def bulk_serve(cashier_id):
+    # Same as pressing serve `count` times
+    count = (request.get_json(silent=True) or {}).get('count', request.form.get('count', 1))
+    try:
+        count = int(count)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'count must be a number'}), 400
+    if not 1 <= count <= BULK_MAX_CUSTOMERS:
+        return jsonify({'error': f'count must be between 1 and {BULK_MAX_CUSTOMERS}'}), 400
+    
+    queue = queue_engine.get_cashier(cashier_id)
+    
+    finished, next_customer = queue_engine.serve_many(queue, count)
+    event_coalescer.queue_updated(queue)
+    return jsonify({
+        'success': True,
+        'served': [customer.otp for customer in finished],
+        'otp': next_customer.otp if next_customer else None
+    })
+
+@app.route('/api/bulk/clear/<int:cashier_id>', methods=['POST'])
+@login_required
+@owner_required
+def bulk_clear(cashier_id):
+    # Removes everyone waiting; the customer at the counter is left to finish
+    queue = queue_engine.get_cashier(cashier_id)
+    
+    waiting = [queue.waiting[ticket] for ticket in queue.tickets]
+    removed = []
+    if waiting:
+        _, removed, _ = queue_engine.remove_many(waiting)[0]
+    event_coalescer.queue_updated(queue)
+    return jsonify({'success': True, 'removed': len(removed)})
+
+@app.route('/api/bulk/remove_customers', methods=['POST'])
+@login_required
+def bulk_remove_customers():
+    customer_ids = (request.get_json(silent=True) or {}).get('customer_ids')
+    # JSON true and false would otherwise pass as the ids 1 and 0
+    if not isinstance(customer_ids, list) or not all(
+            isinstance(customer_id, int) and not isinstance(customer_id, bool) for customer_id in customer_ids):
+        return jsonify({'error': 'customer_ids must be a list of customer IDs'}), 400
+    if len(customer_ids) > BULK_MAX_CUSTOMERS:
+        return jsonify({'error': f'At most {BULK_MAX_CUSTOMERS} customers per request'}), 400
+    
+    entries = {}
+    skipped = []
+    for customer_id in customer_ids:
+        entry = queue_engine.find_by_id(customer_id)
+        if entry is None:
+            skipped.append(customer_id)
+        else:
+            entries[entry.id] = entry
+    
+    # Check the admin owns every company involved
+    cashier_ids = {entry.cashier_id for entry in entries.values()}
+    if any(cashier_info(cashier_id).admin_id != int(session.get('admin_id')) for cashier_id in cashier_ids):
+        return jsonify({'error': 'Unauthorized access'}), 403
+    
+    removed = set()
+    if entries:
+        for queue, finished, next_customer in queue_engine.remove_many(list(entries.values())):
+            event_coalescer.queue_updated(queue)
+            removed.update(entry.id for entry in finished)
+    # Another worker may have served, removed or moved some of them since the lookup
+    skipped.extend(customer_id for customer_id in entries if customer_id not in removed)
+    return jsonify({'success': True, 'removed': len(removed), 'skipped': skipped})
+
+# Socket.IO room membership
+@socketio.on('join_company_room')
+def handle_join_company_room(data):
+    company_code = (data or {}).get('company_code')
+    company = company_info(company_code) if company_code else None
+    if not company:
+        return
+    
+    join_room(company_room(company.company_code))
+    
+    # Only the owning admin receives per-customer events for the whole company
+    admin_id = session.get('admin_id')
+    if admin_id and company.admin_id == int(admin_id):
+        join_room(admin_room(company.company_code))
+
 # Ensure application variable exists for Gunicorn
 application = app
 
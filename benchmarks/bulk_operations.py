@@ -0,0 +1,87 @@
+# benchmarks/bulk_operations.py - Bulk admin actions against one request each
+#
+# For each action - serve N, remove N chosen customers, clear the waiting
+# customers - fills a fresh cashier with --customers waiting customers, runs the
+# action once through the bulk endpoint and once as the equivalent single
+# requests, and reports wall time, requests, SQL statements and Socket.IO
+# events emitted to the admin pages for both.
+#
+#   python benchmarks/bulk_operations.py --customers 500
+
+import argparse
+import json
+import time
+
+from common import load_app, login, create_company, join_customers, QueryCounter
+
+def run(queue_app, admin, counter, name, customers, action):
+    company_id, company_code, cashier_ids = create_company(queue_app, admin, name=name)
+    join_customers(admin, company_code, customers + 1)
+    with queue_app.app.app_context():
+        queue_app.event_coalescer.flush()
+        Customer = queue_app.Customer
+        waiting = [c.id for c in Customer.query.filter_by(cashier_id=cashier_ids[0], status='waiting').order_by(Customer.ticket)]
+
+    emits = sum(queue_app.metrics.emits.values())
+    counter.reset()
+    start = time.perf_counter()
+    requests = action(cashier_ids[0], waiting)
+    with queue_app.app.app_context():
+        queue_app.event_coalescer.flush()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'ms': round(elapsed * 1000, 1),
+        'requests': requests,
+        'queries': counter.queries,
+        'emits': sum(queue_app.metrics.emits.values()) - emits
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--customers', type=int, default=300, help='waiting customers per run')
+    args = parser.parse_args()
+
+    queue_app = load_app()
+    admin = login(queue_app)
+    counter = QueryCounter(queue_app)
+    half = args.customers // 2
+
+    def single(url):
+        def action(cashier_id, waiting):
+            for customer_id in waiting:
+                admin.post(url.format(cashier_id=cashier_id, customer_id=customer_id))
+            return len(waiting)
+        return action
+
+    def bulk(url, body=None):
+        def action(cashier_id, waiting):
+            admin.post(url.format(cashier_id=cashier_id), json=body(waiting) if body else None)
+            return 1
+        return action
+
+    actions = {
+        f'serve {half}': (
+            lambda cashier_id, waiting: single('/api/serve_customer/{cashier_id}')(cashier_id, waiting[:half]),
+            bulk('/api/bulk/serve/{cashier_id}', lambda waiting: {'count': half})
+        ),
+        f'remove {half} chosen': (
+            lambda cashier_id, waiting: single('/api/remove_customer/{customer_id}')(cashier_id, waiting[::2]),
+            bulk('/api/bulk/remove_customers', lambda waiting: {'customer_ids': waiting[::2]})
+        ),
+        f'clear {args.customers} waiting': (
+            single('/api/remove_customer/{customer_id}'),
+            bulk('/api/bulk/clear/{cashier_id}')
+        ),
+    }
+
+    report = {}
+    for number, (name, (one_by_one, in_bulk)) in enumerate(actions.items()):
+        report[name] = {
+            'one_by_one': run(queue_app, admin, counter, f'Single {number}', args.customers, one_by_one),
+            'bulk': run(queue_app, admin, counter, f'Bulk {number}', args.customers, in_bulk)
+        }
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+# benchmarks/close_cashier.py - Closing a cashier with thousands waiting
+#
+# Fills one cashier with --customers waiting customers (the other cashiers get
+# --others each), opens an /api/stream for each of them and closes the cashier
+# with /api/close_cashier. Reports how long the close took, its SQL statements,
+# the status events each moved customer's stream received and whether every
+# queue is still in join order with unique tickets.
+#
+# For comparison it then times emptying a queue the old way, one
+# /api/remove_customer per customer, over --compare customers.
+#
+#   python benchmarks/close_cashier.py --customers 5000
+
+import argparse
+import json
+import os
+import time
+from collections import Counter
+
+from common import load_app, login, create_company, join_customers, QueryCounter
+
+# An idle stream gives up waiting after this long, so a stream that missed the
+# close shows up as a heartbeat instead of blocking the read
+os.environ.setdefault('SSE_HEARTBEAT_SECONDS', '0.5')
+
+def next_event(stream):
+    # Reads a stream until its next status event or heartbeat
+    for chunk in stream:
+        if chunk.startswith((b'event: status', b': heartbeat')):
+            return chunk
+    return b''
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--customers', type=int, default=2000, help='waiting at the closed cashier')
+    parser.add_argument('--others', type=int, default=100, help='waiting at each other cashier')
+    parser.add_argument('--cashiers', type=int, default=4)
+    parser.add_argument('--compare', type=int, default=200, help='customers removed one at a time')
+    args = parser.parse_args()
+
+    queue_app = load_app()
+    admin = login(queue_app)
+    company_id, company_code, cashier_ids = create_company(queue_app, admin, num_cashiers=args.cashiers)
+    closed, others = cashier_ids[0], cashier_ids[1:]
+
+    # Everyone joins the first cashier while the others are off, then the
+    # others open and take their own customers
+    for cashier_id in others:
+        admin.post(f'/api/toggle_cashier/{cashier_id}')
+    otps = join_customers(admin, company_code, args.customers + 1)
+    for cashier_id in others:
+        admin.post(f'/api/toggle_cashier/{cashier_id}')
+    join_customers(admin, company_code, args.others * len(others))
+
+    client = queue_app.app.test_client()
+    streams = []
+    for otp in otps[1:]:
+        stream = client.get(f'/api/stream/{otp}', buffered=False)
+        streams.append(stream)
+        next_event(stream.response)
+
+    counter = QueryCounter(queue_app)
+    counter.reset()
+    start = time.perf_counter()
+    response = admin.post(f'/api/close_cashier/{closed}')
+    elapsed = time.perf_counter() - start
+    queries = counter.queries
+    with queue_app.app.app_context():
+        queue_app.event_coalescer.flush()
+
+    messages = Counter(next_event(stream.response).startswith(b'event: status') for stream in streams)
+    for stream in streams:
+        stream.close()
+
+    with queue_app.app.app_context():
+        Customer = queue_app.Customer
+        active = Customer.query.filter(Customer.status.in_(['waiting', 'serving'])).order_by(Customer.ticket).all()
+        duplicate_tickets = sum(n - 1 for n in Counter((c.cashier_id, c.ticket) for c in active).values() if n > 1)
+        in_join_order = all(
+            all(a.join_time <= b.join_time for a, b in zip(queue, queue[1:]))
+            for queue in ([c for c in active if c.cashier_id == cashier_id and c.status == 'waiting'] for cashier_id in others)
+        )
+        left_behind = sum(1 for c in active if c.cashier_id == closed and c.status == 'waiting')
+
+    # The old way: one request per customer
+    compare_ids = [c.id for c in active if c.status == 'waiting'][:args.compare]
+    start = time.perf_counter()
+    for customer_id in compare_ids:
+        admin.post(f'/api/remove_customer/{customer_id}')
+    with queue_app.app.app_context():
+        queue_app.event_coalescer.flush()
+    per_removal = (time.perf_counter() - start) / max(1, len(compare_ids))
+
+    print(json.dumps({
+        'moved': response.get_json().get('moved'),
+        'close_ms': round(elapsed * 1000, 1),
+        'close_queries': queries,
+        'moved_streams_updated': messages[True],
+        'moved_streams_not_updated': messages[False],
+        'duplicate_tickets': duplicate_tickets,
+        'queues_in_join_order': in_join_order,
+        'left_behind': left_behind,
+        'remove_one_by_one_ms_per_customer': round(per_removal * 1000, 2),
+        'remove_one_by_one_estimated_ms': round(per_removal * args.customers * 1000, 1)
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
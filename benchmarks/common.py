@@ -0,0 +1,78 @@
+# benchmarks/common.py - Shared setup for the benchmark scripts
+#
+# Every benchmark runs the real application against a throwaway SQLite
+# database (or DATABASE_URL if it is set) so numbers are comparable between runs.
+
+import logging
+import os
+import sys
+import tempfile
+import threading
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def load_app():
+    # app.py creates persistent_data/ in the working directory, so import it
+    # from a scratch directory to keep benchmark data away from real data
+    os.chdir(tempfile.mkdtemp(prefix='queue_bench_'))
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+    
+    import app as queue_app
+    
+    # The app logs every queue operation at DEBUG level which would dominate timings
+    logging.disable(logging.CRITICAL)
+    return queue_app
+
+def login(queue_app):
+    client = queue_app.app.test_client()
+    client.post('/login', data={
+        'username': os.getenv('DEFAULT_ADMIN_USERNAME', 'admin'),
+        'password': os.getenv('DEFAULT_ADMIN_PASSWORD', 'password')
+    })
+    return client
+
+def create_company(queue_app, client, num_cashiers=1, name='Benchmark'):
+    client.post('/create_company', data={
+        'name': name,
+        'service_type': 'benchmark',
+        'num_cashiers': str(num_cashiers)
+    })
+    with queue_app.app.app_context():
+        company = queue_app.Company.query.filter_by(name=name).order_by(queue_app.Company.id.desc()).first()
+        cashier_ids = [c.id for c in queue_app.Cashier.query.filter_by(company_id=company.id).order_by(queue_app.Cashier.cashier_number)]
+        return company.id, company.company_code, cashier_ids
+
+def join_customers(client, company_code, count):
+    return [client.post(f'/api/join_queue/{company_code}').get_json()['otp'] for _ in range(count)]
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def summarize(samples):
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3)
+    }
+
+class QueryCounter:
+    # Counts SQL statements per thread (per greenlet once gevent has patched threading)
+    def __init__(self, queue_app):
+        from sqlalchemy import event
+        
+        self.local = threading.local()
+        with queue_app.app.app_context():
+            event.listen(queue_app.db.engine, 'before_cursor_execute', self._count)
+    
+    def _count(self, conn, cursor, statement, parameters, context, executemany):
+        self.local.queries = getattr(self.local, 'queries', 0) + 1
+    
+    def reset(self):
+        self.local.queries = 0
+    
+    @property
+    def queries(self):
+        return getattr(self.local, 'queries', 0)
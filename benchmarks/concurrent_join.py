@@ -0,0 +1,83 @@
+# benchmarks/concurrent_join.py - Simultaneous joins: duplicates and queries per join
+#
+# Fires many /api/join_queue requests at once from a thread pool and checks that
+# no two active customers of a cashier share a ticket (and therefore a position).
+# Set QUEUE_ENGINE_TTL to a positive value to exercise the multi-worker path that
+# allocates tickets under the company lock.
+#
+# After one warm-up join has filled the caches, a join runs one INSERT, plus an
+# OTP block reservation now and then. The shared path also locks the company
+# and reloads the cashiers' queues, so the default bound on statements per
+# join depends on the mode. Exits non-zero on duplicate tickets, a cashier
+# serving two customers at once, or a join over --max-queries statements, so it
+# can gate a change:
+#
+#   python benchmarks/concurrent_join.py --joins 500 --threads 50
+
+import argparse
+import json
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from common import load_app, login, create_company, QueryCounter
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--joins', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=50)
+    parser.add_argument('--cashiers', type=int, default=4)
+    parser.add_argument('--max-queries', type=int,
+                        help='SQL statements allowed per join (default 2, or 10 with QUEUE_ENGINE_TTL set)')
+    args = parser.parse_args()
+    
+    queue_app = load_app()
+    admin = login(queue_app)
+    company_id, company_code, cashier_ids = create_company(queue_app, admin, num_cashiers=args.cashiers)
+    
+    # Count statements per request on each thread
+    counter = QueryCounter(queue_app)
+    max_queries = args.max_queries if args.max_queries is not None else (2 if queue_app.queue_engine.ttl == 0 else 10)
+    
+    # The first join loads the company into the metadata cache
+    admin.post(f'/api/join_queue/{company_code}')
+    
+    def join(_):
+        client = queue_app.app.test_client()
+        counter.reset()
+        response = client.post(f'/api/join_queue/{company_code}')
+        return response.status_code, counter.queries
+    
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        results = list(pool.map(join, range(args.joins)))
+    elapsed = time.perf_counter() - start
+    
+    with queue_app.app.app_context():
+        customers = queue_app.Customer.query.filter(
+            queue_app.Customer.status.in_(['waiting', 'serving'])
+        ).all()
+        tickets = Counter((c.cashier_id, c.ticket) for c in customers)
+        serving = Counter(c.cashier_id for c in customers if c.status == 'serving')
+    
+    queries = [count for status, count in results if status == 200]
+    report = {
+        'joins': args.joins,
+        'threads': args.threads,
+        'succeeded': len(queries),
+        'failed': len(results) - len(queries),
+        'joins_per_second': round(len(results) / elapsed, 1),
+        'duplicate_tickets': sum(n - 1 for n in tickets.values() if n > 1),
+        'cashiers_with_several_serving': sum(1 for n in serving.values() if n > 1),
+        'queries_per_join_max': max(queries) if queries else None,
+        'queries_per_join_avg': round(sum(queries) / len(queries), 2) if queries else None,
+        'queries_per_join_allowed': max_queries
+    }
+    print(json.dumps(report, indent=2))
+    if (report['failed'] or report['duplicate_tickets'] or report['cashiers_with_several_serving']
+            or report['queries_per_join_max'] > max_queries):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
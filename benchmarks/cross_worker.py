@@ -0,0 +1,143 @@
+# benchmarks/cross_worker.py - Events emitted on one worker reach clients of another
+#
+# Runs the app as worker A with SOCKETIO_MESSAGE_QUEUE=memory:// and serves a
+# second Socket.IO server, worker B, on the same LocalPubSubManager channel from
+# this process over HTTP. One client connected to B joins a company's rooms and
+# another joins a second company's rooms, both over the Engine.IO polling
+# transport as a browser would. Worker A then switches a cashier off and on
+# again and adds a customer. The first client must receive both
+# cashier_status_change events and the queue_updated diff exactly once, and the
+# second client must receive nothing. Worker B also keeps its own metadata
+# cache, listening on METADATA_CHANNEL, with both companies and the cashier
+# loaded; switching the cashier must drop that cashier and its company there
+# and leave the other company cached. Exits non-zero on any missing, duplicated
+# or misdirected event or invalidation, so it can gate a change:
+#
+#   python benchmarks/cross_worker.py
+
+from gevent import monkey
+monkey.patch_all()
+
+import json
+import os
+import sys
+from urllib.request import Request, urlopen
+
+os.environ['SOCKETIO_MESSAGE_QUEUE'] = 'memory://'
+os.environ['QUEUE_EVENT_WINDOW_MS'] = '0'
+
+import gevent
+from flask import Flask
+from flask_socketio import SocketIO, join_room
+from gevent.pywsgi import WSGIServer
+
+from common import load_app, login, create_company
+
+EXPECTED = {'cashier_status_change': 2, 'queue_updated': 1}
+
+class PollingClient:
+    # Just enough of the Engine.IO 4 polling transport to join rooms and
+    # collect the events pushed afterwards
+    def __init__(self, port):
+        self.url = f'http://127.0.0.1:{port}/socket.io/?EIO=4&transport=polling'
+        self.sid = json.loads(self._request()[0][1:])['sid']
+        self.url += f'&sid={self.sid}'
+        self._request('40')
+        self.events = []
+        self.receiver = gevent.spawn(self._receive)
+
+    def _request(self, data=None):
+        request = Request(self.url, data=data.encode() if data is not None else None,
+                          headers={'Content-Type': 'text/plain;charset=UTF-8'})
+        with urlopen(request) as response:
+            return response.read().decode().split('\x1e')
+
+    def _receive(self):
+        while True:
+            for packet in self._request():
+                if packet == '2':
+                    self._request('3')
+                elif packet.startswith('42'):
+                    self.events.append(json.loads(packet[2:]))
+
+    def emit(self, event, data):
+        self._request('42' + json.dumps([event, data]))
+
+    def take_events(self):
+        counts = {}
+        for name, *_ in self.events:
+            counts[name] = counts.get(name, 0) + 1
+        self.events = []
+        return counts
+
+    def close(self):
+        self.receiver.kill()
+
+def serve_worker_b(queue_app):
+    # Worker B has no routes of its own, only a Socket.IO server on the same channel
+    flask_b = Flask('worker_b')
+    worker_b = SocketIO(flask_b, async_mode='gevent',
+                        client_manager=queue_app.LocalPubSubManager(channel=queue_app.SOCKETIO_CHANNEL))
+
+    @worker_b.on('join')
+    def join(rooms):
+        for room in rooms:
+            join_room(room)
+
+    server = WSGIServer(('127.0.0.1', 0), flask_b, log=None)
+    server.start()
+
+    # Worker B's metadata cache, fed by the same channel as the app's
+    cache = queue_app.MetadataCache(60, 100)
+    manager = queue_app.LocalPubSubManager(channel=queue_app.METADATA_CHANNEL)
+    manager.set_server(worker_b.server)
+    worker_b.start_background_task(queue_app.listen_for_metadata_invalidation, manager, cache)
+    return server.server_port, cache
+
+def main():
+    queue_app = load_app()
+    admin = login(queue_app)
+    company_id, company_code, cashier_ids = create_company(queue_app, admin, name='Cross worker')
+    other_id, other_code, other_cashier_ids = create_company(queue_app, admin, name='Cross worker other')
+
+    port, cache = serve_worker_b(queue_app)
+    cached = [('company', company_code), ('company', other_code), ('cashier', cashier_ids[0])]
+    for key in cached:
+        cache.get(key, lambda: 'loaded on worker B')
+    follower = PollingClient(port)
+    follower.emit('join', [queue_app.company_room(company_code), queue_app.admin_room(company_code)])
+    bystander = PollingClient(port)
+    bystander.emit('join', [queue_app.company_room(other_code), queue_app.admin_room(other_code)])
+    gevent.sleep(0.5)
+    follower.take_events()
+    bystander.take_events()
+
+    # Everything below is emitted by worker A
+    admin.post(f'/api/toggle_cashier/{cashier_ids[0]}')
+    admin.post(f'/api/toggle_cashier/{cashier_ids[0]}')
+    admin.post(f'/api/join_queue/{company_code}')
+
+    # Give worker B's listener and the long-polls a chance to deliver
+    gevent.sleep(1)
+    received = follower.take_events()
+    misdirected = bystander.take_events()
+    follower.close()
+    bystander.close()
+
+    still_cached = [key for key in cached if key in cache.entries]
+
+    ok = (all(received.get(name) == count for name, count in EXPECTED.items()) and not misdirected
+          and still_cached == [('company', other_code)])
+    print(json.dumps({
+        'expected': EXPECTED,
+        'received_on_worker_b': received,
+        'received_by_other_company': misdirected,
+        'cached_on_worker_b_before': [list(key) for key in cached],
+        'cached_on_worker_b_after': [list(key) for key in still_cached],
+        'ok': ok
+    }, indent=2))
+    if not ok:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
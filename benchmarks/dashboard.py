@@ -0,0 +1,51 @@
+# benchmarks/dashboard.py - Dashboard latency vs the number of companies
+#
+# Grows one admin's companies step by step up to the largest --companies value,
+# each with --cashiers cashiers and a few waiting customers, and times
+# --requests dashboard loads at every step. Reports p50/p95/p99 latency and SQL
+# statements per load; both should stay flat apart from rendering the cards.
+#
+#   python benchmarks/dashboard.py --companies 1 10 100 500
+
+import argparse
+import json
+import time
+
+from common import load_app, login, create_company, join_customers, summarize, QueryCounter
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--companies', type=int, nargs='+', default=[1, 10, 50, 200])
+    parser.add_argument('--cashiers', type=int, default=3)
+    parser.add_argument('--customers', type=int, default=5, help='waiting customers per company')
+    parser.add_argument('--requests', type=int, default=50, help='dashboard loads per step')
+    args = parser.parse_args()
+
+    queue_app = load_app()
+    admin = login(queue_app)
+    counter = QueryCounter(queue_app)
+
+    report = []
+    created = 0
+    for companies in sorted(args.companies):
+        while created < companies:
+            company_id, company_code, cashier_ids = create_company(queue_app, admin, num_cashiers=args.cashiers, name=f'Dashboard {created}')
+            join_customers(admin, company_code, args.customers)
+            created += 1
+
+        admin.get('/dashboard')  # warm up
+        samples = []
+        queries = []
+        for _ in range(args.requests):
+            counter.reset()
+            start = time.perf_counter()
+            response = admin.get('/dashboard')
+            samples.append(time.perf_counter() - start)
+            queries.append(counter.queries)
+            assert response.status_code == 200, response.status_code
+
+        report.append({'companies': companies, 'queries': max(queries), **summarize(samples)})
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
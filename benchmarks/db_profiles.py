@@ -0,0 +1,111 @@
+# benchmarks/db_profiles.py - Concurrent check_status throughput per pool profile
+#
+# Runs the app once per DB_POOL_PROFILE, each in its own process because the
+# engine options are fixed at import. Every run fills a cashier, serves some
+# customers so their status comes from the database rather than the queue
+# engine, and then polls /api/check_status for them from --threads threads for
+# --seconds while one more thread keeps joining new customers, so readers
+# compete with a writer. Reports status polls per second, failed polls and the
+# joins that got through in the same time. Many more threads than cores mostly
+# measures the GIL rather than the database.
+#
+#   python benchmarks/db_profiles.py --threads 8 --seconds 5
+#   DATABASE_URL=postgresql://... python benchmarks/db_profiles.py --profiles standard pgbouncer
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+def measure(args):
+    from common import load_app, login, create_company, join_customers
+
+    queue_app = load_app()
+    admin = login(queue_app)
+    company_id, company_code, cashier_ids = create_company(queue_app, admin)
+    otps = join_customers(admin, company_code, args.customers)
+    for _ in range(args.customers // 2):
+        admin.post(f'/api/serve_customer/{cashier_ids[0]}')
+    finished = otps[:args.customers // 2 - 1]
+
+    stop = threading.Event()
+    polls = []
+    failures = []
+    joins = []
+
+    def poll(number):
+        client = queue_app.app.test_client()
+        done = failed = 0
+        while not stop.is_set():
+            response = client.get(f'/api/check_status/{finished[(number + done + failed) % len(finished)]}')
+            if response.status_code == 200:
+                done += 1
+            else:
+                failed += 1
+        polls.append(done)
+        failures.append(failed)
+
+    def join():
+        client = queue_app.app.test_client()
+        done = 0
+        while not stop.is_set():
+            if client.post(f'/api/join_queue/{company_code}').status_code == 200:
+                done += 1
+        joins.append(done)
+
+    threads = [threading.Thread(target=poll, args=(number,)) for number in range(args.threads)]
+    threads.append(threading.Thread(target=join))
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    with queue_app.app.app_context():
+        engine = queue_app.db.engine
+        pragmas = {}
+        if engine.dialect.name == 'sqlite':
+            with engine.connect() as connection:
+                pragmas = {name: connection.exec_driver_sql(f'PRAGMA {name}').scalar() for name in queue_app.SQLITE_PRAGMAS}
+
+    print(json.dumps({
+        'database': engine.dialect.name,
+        'pool': type(engine.pool).__name__,
+        'pragmas': pragmas,
+        'check_status_per_second': round(sum(polls) / elapsed, 1),
+        'failed_polls': sum(failures),
+        'joins_per_second': round(sum(joins) / elapsed, 1)
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--profiles', nargs='+', default=['stock', 'standard', 'pgbouncer'])
+    parser.add_argument('--threads', type=int, default=8, help='threads polling check_status')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--customers', type=int, default=200)
+    parser.add_argument('--measure', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args)
+        return
+
+    report = {}
+    for profile in args.profiles:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--measure',
+             '--threads', str(args.threads), '--seconds', str(args.seconds), '--customers', str(args.customers)],
+            env={**os.environ, 'DB_POOL_PROFILE': profile},
+            capture_output=True, text=True, check=True
+        ).stdout
+        report[profile] = json.loads(output.strip().splitlines()[-1])
+    print(json.dumps(report, indent=2))
+
+if __name__ == '__main__':
+    main()
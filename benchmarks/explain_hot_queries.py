@@ -0,0 +1,80 @@
+# benchmarks/explain_hot_queries.py - Check that the hot queries use their indexes
+#
+# Seeds a company with some history, then runs EXPLAIN (EXPLAIN QUERY PLAN on
+# SQLite) for each query the app issues on every request and checks that the
+# plan names the expected index. Exits non-zero if any query falls back to a
+# table scan. The tables are small, so statistics are left out on SQLite and
+# sequential scans are disabled on Postgres - otherwise the planner would
+# rightly prefer scanning a handful of rows.
+#
+#   python benchmarks/explain_hot_queries.py
+#   DATABASE_URL=postgresql://... python benchmarks/explain_hot_queries.py
+
+import argparse
+import json
+import sys
+
+from common import load_app, login, create_company, join_customers
+
+def hot_queries(queue_app, company_id, cashier_id, otp):
+    Cashier = queue_app.Cashier
+    Customer = queue_app.Customer
+    QueueHistory = queue_app.QueueHistory
+    db = queue_app.db
+    
+    return [
+        ('customer by otp', 'ix_customer_otp',
+         Customer.query.filter_by(otp=otp)),
+        ('active customer by otp', 'uq_customer_active_otp',
+         Customer.query.filter(Customer.otp == otp, Customer.status.in_(['waiting', 'serving']))),
+        ('active queue of a cashier', 'uq_customer_active_ticket',
+         Customer.query.filter(
+             Customer.cashier_id == cashier_id,
+             Customer.status.in_(['waiting', 'serving'])
+         ).order_by(Customer.ticket)),
+        ('last ticket of a cashier', 'ix_customer_cashier_status_position',
+         db.session.query(db.func.max(Customer.ticket)).filter(Customer.cashier_id == cashier_id)),
+        ('served count of a company', 'ix_queue_history_company_status',
+         db.session.query(db.func.count(QueueHistory.id)).filter_by(company_id=company_id, status='served')),
+        ('active cashiers of a company', 'ix_cashier_company_active',
+         Cashier.query.filter_by(company_id=company_id, is_active=True)),
+    ]
+
+def explain(queue_app, query):
+    db = queue_app.db
+    dialect = db.engine.dialect
+    statement = query.statement.compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.execute(db.text(prefix + str(statement))).all()
+    return '\n'.join(str(row[-1]) for row in rows)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--customers', type=int, default=200)
+    args = parser.parse_args()
+    
+    queue_app = load_app()
+    admin = login(queue_app)
+    company_id, company_code, cashier_ids = create_company(queue_app, admin, num_cashiers=2)
+    otps = join_customers(queue_app.app.test_client(), company_code, args.customers)
+    for cashier_id in cashier_ids:
+        for _ in range(args.customers // 4):
+            admin.post(f'/api/serve_customer/{cashier_id}')
+    
+    results = []
+    with queue_app.app.app_context():
+        db = queue_app.db
+        if db.engine.dialect.name != 'sqlite':
+            db.session.execute(db.text('SET enable_seqscan = off'))
+        
+        for name, index, query in hot_queries(queue_app, company_id, cashier_ids[0], otps[-1]):
+            plan = explain(queue_app, query)
+            results.append({'query': name, 'index': index, 'uses_index': index in plan, 'plan': plan})
+        db.session.rollback()
+    
+    print(json.dumps(results, indent=2))
+    if not all(result['uses_index'] for result in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+# benchmarks/load_test.py - Load test of the whole queue workflow
+#
+# Runs the app in-process under gevent against a throwaway SQLite database, or
+# DATABASE_URL if it is set (e.g. a local Postgres), and plays out a day at one
+# company at high speed:
+#
+#   customers  arrive over --ramp seconds, join through /api/join_queue and then
+#              follow their ticket like queue_status.js does - --streams of them
+#              read the /api/stream events until their ticket is finished, the
+#              rest poll /api/check_status every --poll-interval seconds with
+#              If-None-Match, as browsers without EventSource do
+#   cashiers   look at /api/get_cashier_queue and call /api/serve_customer
+#              every --service-interval seconds, sending --delay-rate of the
+#              customers at the counter to the back with /api/delay_customer
+#   admins     --admins manage_company pages stay connected over Socket.IO and
+#              receive every queue_updated diff
+#
+# The run ends when every customer has left the queue or after --duration
+# seconds. Throughput, p50/p95/p99 latency and SQL statements per request are
+# reported per route as JSON, so runs can be compared between releases:
+#
+#   python benchmarks/load_test.py --customers 2000 --cashiers 8 --output run.json
+
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime
+
+import gevent
+from gevent.pool import Group
+
+from common import ROOT_DIR, load_app, login, create_company, summarize, QueryCounter
+
+class Recorder:
+    def __init__(self, counter):
+        self.counter = counter
+        self.samples = {}  # route -> [(seconds, queries, status)]
+    
+    def request(self, route, send):
+        self.counter.reset()
+        start = time.perf_counter()
+        response = send()
+        elapsed = time.perf_counter() - start
+        self.samples.setdefault(route, []).append((elapsed, self.counter.queries, response.status_code))
+        return response
+    
+    def report(self, elapsed):
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            queries = [sample[1] for sample in samples]
+            routes[route] = {
+                **summarize([sample[0] for sample in samples]),
+                'requests_per_second': round(len(samples) / elapsed, 1),
+                'errors': sum(1 for sample in samples if sample[2] >= 400),
+                'not_modified': sum(1 for sample in samples if sample[2] == 304),
+                'queries_per_request_avg': round(sum(queries) / len(queries), 2),
+                'queries_per_request_max': max(queries)
+            }
+        return routes
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--customers', type=int, default=1000)
+    parser.add_argument('--cashiers', type=int, default=4)
+    parser.add_argument('--streams', type=float, default=0.5, help='share of customers following /api/stream')
+    parser.add_argument('--admins', type=int, default=50, help='admin pages connected over Socket.IO')
+    parser.add_argument('--ramp', type=float, default=5.0, help='seconds over which customers arrive')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--service-interval', type=float, default=0.02)
+    parser.add_argument('--delay-rate', type=float, default=0.05)
+    parser.add_argument('--duration', type=float, default=120.0, help='upper bound on the run in seconds')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+    
+    random.seed(args.seed)
+    queue_app = load_app()
+    admin = login(queue_app)
+    company_id, company_code, cashier_ids = create_company(queue_app, admin, num_cashiers=args.cashiers, name='Load test')
+    
+    admin_sockets = []
+    for _ in range(args.admins):
+        admin_socket = queue_app.socketio.test_client(queue_app.app, flask_test_client=admin)
+        admin_socket.emit('join_company_room', {'company_code': company_code})
+        admin_sockets.append(admin_socket)
+    socket_messages = 0
+    
+    recorder = Recorder(QueryCounter(queue_app))
+    remaining = set(range(args.customers))
+    streams = []
+    status_events = 0
+    deadline = None
+    
+    def customer(number):
+        nonlocal status_events
+        gevent.sleep(random.uniform(0, args.ramp))
+        client = queue_app.app.test_client()
+        response = recorder.request('/api/join_queue/<company_code>',
+                                    lambda: client.post(f'/api/join_queue/{company_code}'))
+        if response.status_code != 200:
+            remaining.discard(number)
+            return
+        otp = response.get_json()['otp']
+        
+        if random.random() < args.streams:
+            stream = recorder.request('/api/stream/<otp>',
+                                      lambda: client.get(f'/api/stream/{otp}', buffered=False))
+            streams.append(stream)
+            # The stream ends by itself once the ticket is served or removed
+            with gevent.Timeout(max(0, deadline - time.monotonic()), False):
+                for chunk in stream.response:
+                    status_events += chunk.count(b'event: status')
+            stream.close()
+            remaining.discard(number)
+            return
+        
+        etag = None
+        while time.monotonic() < deadline:
+            gevent.sleep(args.poll_interval * random.uniform(0.8, 1.2))
+            headers = {'If-None-Match': etag} if etag else {}
+            response = recorder.request('/api/check_status/<otp>',
+                                        lambda: client.get(f'/api/check_status/{otp}', headers=headers))
+            if response.status_code == 200:
+                etag = response.headers.get('ETag')
+                if response.get_json()['status'] in ('served', 'removed'):
+                    break
+        
+        remaining.discard(number)
+    
+    def cashier(cashier_id):
+        client = login(queue_app)
+        while remaining and time.monotonic() < deadline:
+            gevent.sleep(args.service_interval)
+            queue = recorder.request('/api/get_cashier_queue/<cashier_id>',
+                                     lambda: client.get(f'/api/get_cashier_queue/{cashier_id}')).get_json()['queue']
+            serving = [c for c in queue if c['status'] == 'serving']
+            if serving and random.random() < args.delay_rate:
+                recorder.request('/api/delay_customer/<customer_id>',
+                                 lambda: client.post(f'/api/delay_customer/{serving[0]["id"]}'))
+            else:
+                recorder.request('/api/serve_customer/<cashier_id>',
+                                 lambda: client.post(f'/api/serve_customer/{cashier_id}'))
+    
+    def drain_admins():
+        # The admin pages apply diffs as they arrive
+        nonlocal socket_messages
+        while remaining and time.monotonic() < deadline:
+            gevent.sleep(0.5)
+            for admin_socket in admin_sockets:
+                socket_messages += len(admin_socket.get_received())
+    
+    start = time.perf_counter()
+    deadline = time.monotonic() + args.duration
+    group = Group()
+    for number in range(args.customers):
+        group.spawn(customer, number)
+    for cashier_id in cashier_ids:
+        group.spawn(cashier, cashier_id)
+    group.spawn(drain_admins)
+    group.join()
+    elapsed = time.perf_counter() - start
+    
+    with queue_app.app.app_context():
+        dialect = queue_app.db.engine.dialect.name
+        left_in_queue = queue_app.Customer.query.filter(
+            queue_app.Customer.status.in_(['waiting', 'serving'])
+        ).count()
+    
+    total = sum(len(samples) for samples in recorder.samples.values())
+    report = {
+        'run': {
+            'timestamp': datetime.utcnow().isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'database': dialect,
+            'options': vars(args)
+        },
+        'elapsed_seconds': round(elapsed, 2),
+        'requests': total,
+        'requests_per_second': round(total / elapsed, 1),
+        'socket_clients': len(admin_sockets),
+        'socket_messages_delivered': socket_messages,
+        'stream_clients': len(streams),
+        'status_events_pushed': status_events,
+        'customers_left_in_queue': left_in_queue,
+        'timed_out': time.monotonic() >= deadline,
+        'queue_events': queue_app.event_coalescer.stats(),
+        'routes': recorder.report(elapsed)
+    }
+    
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(os.path.join(ROOT_DIR, args.output) if not os.path.isabs(args.output) else args.output, 'w') as f:
+            f.write(output + '\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# benchmarks/otp_allocator.py - Allocate OTPs up to the size of the code space
+#
+# Several allocators, standing in for workers, share the otp_sequence row and
+# take turns allocating until the million 6-digit codes are nearly used up -
+# all but the block each worker may still hold unused. Fails if any OTP
+# repeats or is not six digits, and reports allocations per second and
+# reservation transactions.
+#
+# For comparison it also reports the expected attempts (one query each) of the
+# old scheme - a random code, retried until no existing customer holds it - at
+# the same fill levels.
+#
+#   python benchmarks/otp_allocator.py --workers 4 --block-size 1000
+
+import argparse
+import json
+import random
+import sys
+import time
+
+from common import load_app, QueryCounter
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, help='OTPs to allocate (default: as many as are guaranteed unique)')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--block-size', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    queue_app = load_app()
+    counter = QueryCounter(queue_app)
+    space = queue_app.OTP_SPACE
+    # Blocks still held when the run ends use up counter values too
+    count = args.count or space - args.workers * args.block_size
+
+    with queue_app.app.app_context():
+        workers = [queue_app.OtpAllocator(args.block_size) for _ in range(args.workers)]
+        seen = set()
+        duplicates = malformed = 0
+        counter.reset()
+        start = time.perf_counter()
+        for _ in range(count):
+            otp = random.choice(workers).allocate()
+            if otp in seen:
+                duplicates += 1
+            seen.add(otp)
+            if len(otp) != 6 or not otp.isdigit():
+                malformed += 1
+        elapsed = time.perf_counter() - start
+
+    fills = sorted({0.5, 0.9, 0.99, count / space})
+    report = {
+        'allocated': count,
+        'space': space,
+        'workers': args.workers,
+        'block_size': args.block_size,
+        'duplicates': duplicates,
+        'malformed': malformed,
+        'allocations_per_second': round(count / elapsed),
+        'queries': counter.queries,
+        'queries_per_allocation': round(counter.queries / count, 4),
+        'random_retry_attempts_per_join': {f'{fill:.1%} full': round(1 / (1 - fill), 1) for fill in fills}
+    }
+    print(json.dumps(report, indent=2))
+    if duplicates or malformed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
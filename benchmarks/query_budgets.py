@@ -0,0 +1,76 @@
+# benchmarks/query_budgets.py - Check SQL statement budgets per route
+#
+# Runs the app with SQL_PROFILE=1, sets up several companies with waiting
+# customers, requests every route once to warm the queue engine and then once
+# more, and compares the X-Query-Count of the second request with the route's
+# budget (@query_budget, QUERY_BUDGET by default). Also fails when a request
+# repeats one statement shape N_PLUS_ONE_THRESHOLD times or more. Exits
+# non-zero on any failure, so it can gate a change:
+#
+#   python benchmarks/query_budgets.py --companies 10 --customers 50
+
+import argparse
+import json
+import os
+import sys
+
+os.environ['SQL_PROFILE'] = '1'
+
+from common import load_app, login, create_company, join_customers
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--companies', type=int, default=8, help='companies on the dashboard')
+    parser.add_argument('--cashiers', type=int, default=3)
+    parser.add_argument('--customers', type=int, default=30, help='waiting customers in the checked company')
+    args = parser.parse_args()
+
+    queue_app = load_app()
+    admin = login(queue_app)
+    for number in range(args.companies - 1):
+        create_company(queue_app, admin, num_cashiers=args.cashiers, name=f'Budget {number}')
+    company_id, company_code, cashier_ids = create_company(queue_app, admin, num_cashiers=args.cashiers, name='Budget')
+    otps = join_customers(queue_app.app.test_client(), company_code, args.customers)
+
+    def customer_id(status):
+        # Delays and removals change the queue, so each request picks its own customer
+        with queue_app.app.app_context():
+            Customer = queue_app.Customer
+            return Customer.query.filter_by(cashier_id=cashier_ids[0], status=status).order_by(Customer.id.desc()).first().id
+
+    requests = [
+        ('get', '/dashboard'),
+        ('get', f'/manage_company/{company_id}'),
+        ('get', f'/api/company_stats/{company_id}'),
+        ('get', f'/api/get_cashier_queue/{cashier_ids[0]}'),
+        ('get', f'/api/check_status/{otps[-1]}'),
+        ('post', f'/api/join_queue/{company_code}'),
+        ('post', f'/api/serve_customer/{cashier_ids[0]}'),
+        ('post', lambda: f'/api/delay_customer/{customer_id("serving")}'),
+        ('post', lambda: f'/api/remove_customer/{customer_id("waiting")}'),
+        ('post', f'/api/toggle_cashier/{cashier_ids[-1]}'),
+        ('get', f'/qr/{company_code}.png'),
+    ]
+
+    results = []
+    for method, url in requests:
+        getattr(admin, method)(url() if callable(url) else url)  # warm up
+        url = url() if callable(url) else url
+        getattr(admin, method)(url)
+        profile = queue_app.sql_profiles[-1]
+        results.append({
+            'route': profile['endpoint'],
+            'url': url,
+            'status': profile['status'],
+            'queries': profile['queries'],
+            'budget': profile['budget'],
+            'repeated': [shape['statement'] for shape in profile['repeated']],
+            'ok': not profile['over_budget'] and not profile['repeated']
+        })
+
+    print(json.dumps(results, indent=2))
+    if not all(result['ok'] for result in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
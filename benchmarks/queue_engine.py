@@ -0,0 +1,77 @@
+# benchmarks/queue_engine.py - check_status and serve_customer latency vs queue length
+#
+# Seeds one cashier with N waiting customers, loads them into the queue engine
+# and times status polls for random OTPs and consecutive serves. Latency should
+# stay flat as the queue grows.
+#
+#   python benchmarks/queue_engine.py --sizes 100,1000,10000
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime
+
+from common import load_app, login, create_company, summarize
+
+def seed_waiting(queue_app, cashier_id, count, first_otp):
+    # Insert directly - going through /api/join_queue would dominate the run.
+    # Customers seeded for earlier sizes are still active, so OTPs continue
+    # from first_otp
+    customer_table = queue_app.Customer.__table__
+    now = datetime.utcnow()
+    rows = [{
+        'cashier_id': cashier_id,
+        'otp': f'{first_otp + i:06d}',
+        'join_time': now,
+        'status': 'serving' if i == 0 else 'waiting',
+        'delays': 0,
+        'position': i + 1,
+        'serving_start_time': now if i == 0 else None
+    } for i in range(count)]
+    with queue_app.app.app_context():
+        queue_app.db.session.execute(customer_table.insert(), rows)
+        queue_app.db.session.commit()
+        queue_app.queue_engine.rebuild()
+    return [row['otp'] for row in rows]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', default='100,1000,10000', help='comma separated waiting queue lengths')
+    parser.add_argument('--polls', type=int, default=2000)
+    parser.add_argument('--serves', type=int, default=200)
+    args = parser.parse_args()
+    
+    queue_app = load_app()
+    admin = login(queue_app)
+    results = []
+    seeded = 0
+    
+    for size in [int(s) for s in args.sizes.split(',')]:
+        company_id, company_code, cashier_ids = create_company(queue_app, admin, name=f'Engine {size}')
+        otps = seed_waiting(queue_app, cashier_ids[0], size, seeded)
+        seeded += size
+        
+        polls = []
+        for _ in range(args.polls):
+            otp = random.choice(otps[args.serves + 1:] or otps)
+            start = time.perf_counter()
+            admin.get(f'/api/check_status/{otp}')
+            polls.append(time.perf_counter() - start)
+        
+        serves = []
+        for _ in range(min(args.serves, size - 1)):
+            start = time.perf_counter()
+            admin.post(f'/api/serve_customer/{cashier_ids[0]}')
+            serves.append(time.perf_counter() - start)
+        
+        results.append({
+            'waiting_customers': size,
+            'check_status': summarize(polls),
+            'serve_customer': summarize(serves)
+        })
+    
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# benchmarks/room_fanout.py - Socket.IO messages delivered per serve
+#
+# Connects --admins admin pages to each of several companies, serves one
+# customer and counts how many socket messages were actually delivered. The
+# "broadcast" figure is what the same emits cost when every event goes to every
+# connected client. Only the admin pages use Socket.IO; status pages follow
+# /api/stream, which benchmarks/status_stream.py measures.
+#
+#   python benchmarks/room_fanout.py --companies 10 --admins 5
+
+import argparse
+import json
+
+from common import load_app, login, create_company, join_customers
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--companies', type=int, default=10)
+    parser.add_argument('--admins', type=int, default=3, help='connected admin pages per company')
+    parser.add_argument('--customers', type=int, default=50, help='waiting customers per company')
+    args = parser.parse_args()
+
+    queue_app = load_app()
+    admin = login(queue_app)
+
+    clients = []
+    companies = []
+    for i in range(args.companies):
+        company_id, company_code, cashier_ids = create_company(queue_app, admin, name=f'Benchmark {i}')
+        companies.append((company_code, cashier_ids[0]))
+        join_customers(admin, company_code, args.customers)
+
+        for _ in range(args.admins):
+            admin_socket = queue_app.socketio.test_client(queue_app.app, flask_test_client=admin)
+            admin_socket.emit('join_company_room', {'company_code': company_code})
+            clients.append(admin_socket)
+
+    with queue_app.app.app_context():
+        queue_app.event_coalescer.flush()
+    for client in clients:
+        client.get_received()
+
+    # Count emits issued by the server during a single serve
+    emits = []
+    original_emit = queue_app.socketio.emit
+    def counting_emit(event, *args, **kwargs):
+        emits.append(event)
+        return original_emit(event, *args, **kwargs)
+    queue_app.socketio.emit = counting_emit
+
+    company_code, cashier_id = companies[0]
+    admin.post(f'/api/serve_customer/{cashier_id}')
+
+    # Push the coalesced queue update now rather than after the window
+    with queue_app.app.app_context():
+        queue_app.event_coalescer.flush()
+
+    delivered = sum(len(client.get_received()) for client in clients)
+    print(json.dumps({
+        'connected_clients': len(clients),
+        'events_emitted': len(emits),
+        'messages_delivered': delivered,
+        'messages_if_broadcast': len(emits) * len(clients)
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
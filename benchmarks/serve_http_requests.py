@@ -0,0 +1,119 @@
+# benchmarks/serve_http_requests.py - HTTP requests triggered by one serve
+#
+# Connects an admin page over Socket.IO and follows every waiting customer of
+# one cashier the way queue_status.js does - --streams of them over
+# /api/stream, the rest by long-polling /api/check_status?wait=N with
+# If-None-Match - then serves one customer and counts the HTTP requests the
+# clients make in response:
+#
+#   queue_status.js      a stream only receives a status event; a long-poll that
+#                        the serve answered is followed by the next long-poll
+#   manage_company.html  refetches every cashier's queue on cashier_status_change;
+#                        applies queue_updated diffs in place
+#
+# "requests_if_refetching" is what the same serve costs when every client that
+# was told the queue changed fetches the new state itself.
+#
+#   python benchmarks/serve_http_requests.py --customers 500
+
+from gevent import monkey
+monkey.patch_all()
+
+import argparse
+import json
+import random
+
+import gevent
+from gevent.pool import Group
+
+from common import load_app, login, create_company, join_customers
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--customers', type=int, default=500, help='waiting customers')
+    parser.add_argument('--streams', type=float, default=0.5, help='share of customers following /api/stream')
+    parser.add_argument('--settle', type=float, default=1.0, help='seconds to wait for clients after the serve')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    queue_app = load_app()
+    admin = login(queue_app)
+    company_id, company_code, cashier_ids = create_company(queue_app, admin)
+
+    admin_socket = queue_app.socketio.test_client(queue_app.app, flask_test_client=admin)
+    admin_socket.emit('join_company_room', {'company_code': company_code})
+
+    served = False
+    status_events = 0
+    answered_polls = 0
+    follow_up_polls = 0
+
+    def stream(otp):
+        nonlocal status_events
+        response = queue_app.app.test_client().get(f'/api/stream/{otp}', buffered=False)
+        try:
+            for chunk in response.response:
+                if served and chunk.startswith(b'event: status'):
+                    status_events += 1
+        finally:
+            response.close()
+
+    def poll(otp):
+        nonlocal answered_polls, follow_up_polls
+        client = queue_app.app.test_client()
+        etag = None
+        while True:
+            if served:
+                follow_up_polls += 1
+            headers = {'If-None-Match': etag} if etag else {}
+            response = client.get(f'/api/check_status/{otp}?wait={queue_app.LONG_POLL_MAX_SECONDS}', headers=headers)
+            if served:
+                answered_polls += 1
+            if response.status_code == 200:
+                etag = response.headers.get('ETag')
+                if response.get_json()['status'] in ('served', 'removed'):
+                    return
+
+    # One more than --customers: the first goes straight to the counter
+    otps = join_customers(admin, company_code, args.customers + 1)
+    streams = {otp for otp in otps if random.random() < args.streams}
+    group = Group()
+    for otp in otps:
+        group.spawn(stream if otp in streams else poll, otp)
+
+    # Let every stream send its first event and every long-poll park
+    gevent.sleep(1)
+    with queue_app.app.app_context():
+        queue_app.event_coalescer.flush()
+    admin_socket.get_received()
+
+    served = True
+    admin.post(f'/api/serve_customer/{cashier_ids[0]}')
+
+    # Push the coalesced queue update now rather than after the window
+    with queue_app.app.app_context():
+        queue_app.event_coalescer.flush()
+    gevent.sleep(args.settle)
+    group.kill()
+
+    received = admin_socket.get_received()
+    events = {}
+    for event in received:
+        events[event['name']] = events.get(event['name'], 0) + 1
+    admin_requests = events.get('cashier_status_change', 0) * len(cashier_ids)
+
+    print(json.dumps({
+        'waiting_customers': args.customers,
+        'stream_clients': len(streams),
+        'long_poll_clients': len(otps) - len(streams),
+        'socket_clients': 1,
+        'status_events_pushed': status_events,
+        'long_polls_answered': answered_polls,
+        'admin_events': events,
+        'follow_up_requests': follow_up_polls + admin_requests,
+        'requests_if_refetching': status_events + answered_polls + (1 if received else 0)
+    }, indent=2))
+
+if __name__ == '__main__':
+    main()
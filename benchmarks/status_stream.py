@@ -0,0 +1,143 @@
+# benchmarks/status_stream.py - Memory and fan-out of /api/stream connections
+#
+# Starts the app under gevent's WSGI server in a child process with --customers
+# waiting customers spread over --cashiers cashiers, opens one /api/stream
+# connection per customer and reports the server's resident memory per idle
+# connection. Then serves one customer at every cashier and times how long it
+# takes until every stream has received its new position, and waits for a
+# heartbeat on every stream (SSE_HEARTBEAT_SECONDS, --heartbeat here).
+#
+# Each connection is one file descriptor on both sides, so raise `ulimit -n`
+# above --customers first:
+#
+#   python benchmarks/status_stream.py --customers 10000
+
+import argparse
+import json
+import os
+import selectors
+import socket
+import subprocess
+import sys
+import time
+
+def serve(args):
+    from gevent import monkey
+    monkey.patch_all()
+    from gevent.pywsgi import WSGIServer
+
+    from common import load_app, login, create_company, join_customers
+
+    queue_app = load_app()
+    admin = login(queue_app)
+    company_id, company_code, cashier_ids = create_company(queue_app, admin, num_cashiers=args.cashiers)
+    otps = join_customers(admin, company_code, args.customers)
+
+    # Without a deep accept backlog, connecting thousands of streams at once stalls on
+    # SYN retries
+    server = WSGIServer(('127.0.0.1', 0), queue_app.app, log=None, backlog=4096)
+    server.start()
+    print(json.dumps({'port': server.server_port, 'otps': otps, 'cashier_ids': cashier_ids}), flush=True)
+    server.serve_forever()
+
+def rss_kb(pid):
+    with open(f'/proc/{pid}/status') as status:
+        for line in status:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+
+def post(port, path):
+    connection = socket.create_connection(('127.0.0.1', port))
+    connection.sendall(f'POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: 0\r\nConnection: close\r\n\r\n'.encode())
+    while connection.recv(65536):
+        pass
+    connection.close()
+
+def read_until(streams, selector, done, timeout):
+    # Reads every stream until done(buffer) holds for all of them
+    pending = {sock for sock, buffer in streams.items() if not done(buffer)}
+    deadline = time.monotonic() + timeout
+    while pending and time.monotonic() < deadline:
+        for key, _ in selector.select(timeout=1):
+            sock = key.fileobj
+            data = sock.recv(65536)
+            streams[sock] += data
+            if sock in pending and done(streams[sock]):
+                pending.discard(sock)
+    return len(pending)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--customers', type=int, default=2000, help='waiting customers, one stream each')
+    parser.add_argument('--cashiers', type=int, default=4)
+    parser.add_argument('--heartbeat', type=float, default=5, help='SSE_HEARTBEAT_SECONDS for the server')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', '--customers', str(args.customers), '--cashiers', str(args.cashiers)],
+        env={**os.environ, 'SSE_HEARTBEAT_SECONDS': str(args.heartbeat)},
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    try:
+        line = server.stdout.readline()
+        while not line.startswith('{'):
+            line = server.stdout.readline()
+        setup = json.loads(line)
+        port = setup['port']
+
+        time.sleep(1)
+        rss_before = rss_kb(server.pid)
+
+        selector = selectors.DefaultSelector()
+        streams = {}
+        start = time.perf_counter()
+        for otp in setup['otps']:
+            sock = socket.create_connection(('127.0.0.1', port))
+            sock.sendall(f'GET /api/stream/{otp} HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n\r\n'.encode())
+            sock.setblocking(False)
+            selector.register(sock, selectors.EVENT_READ)
+            streams[sock] = b''
+        missing_first = read_until(streams, selector, lambda buffer: b'event: status' in buffer, 60)
+        connect_seconds = time.perf_counter() - start
+
+        time.sleep(1)
+        rss_after = rss_kb(server.pid)
+
+        # Everyone behind the counter moves up one place
+        for sock in streams:
+            streams[sock] = b''
+        start = time.perf_counter()
+        for cashier_id in setup['cashier_ids']:
+            post(port, f'/api/serve_customer/{cashier_id}')
+        missing_update = read_until(streams, selector, lambda buffer: b'event: status' in buffer, 60)
+        fanout_seconds = time.perf_counter() - start
+
+        # Streams of the customers just served have ended
+        for sock in [sock for sock, buffer in streams.items() if b'"status": "served"' in buffer]:
+            selector.unregister(sock)
+            del streams[sock]
+        for sock in streams:
+            streams[sock] = b''
+        missing_heartbeat = read_until(streams, selector, lambda buffer: b': heartbeat' in buffer, args.heartbeat * 3)
+
+        print(json.dumps({
+            'streams': args.customers,
+            'connect_and_first_event_s': round(connect_seconds, 2),
+            'streams_without_first_event': missing_first,
+            'server_rss_before_mb': round(rss_before / 1024, 1),
+            'server_rss_after_mb': round(rss_after / 1024, 1),
+            'kb_per_idle_stream': round((rss_after - rss_before) / args.customers, 1),
+            'serve_fanout_ms': round(fanout_seconds * 1000, 1),
+            'streams_without_update': missing_update,
+            'streams_without_heartbeat': missing_heartbeat
+        }, indent=2))
+    finally:
+        server.kill()
+
+if __name__ == '__main__':
+    main()
@@ -29,8 +29,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // App State
     let state = {
         isJoining: false,
-        currentRequest: null,
-        socketInstance: null
+        currentRequest: null
     };
     
     // Initialize - Check for existing queue data
@@ -114,7 +113,8 @@ document.addEventListener('DOMContentLoaded', function() {
             headers: { 'Cache-Control': 'no-cache' }
         })
         .then(response => {
-            if (!response.ok) {
+            // 404 carries an error body: the OTP is no longer known
+            if (!response.ok && response.status !== 404) {
                 throw new Error('Failed to verify queue status');
             }
             return response.json();
@@ -249,45 +249,6 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
-    function initializeSocket(otp) {
-        if (state.socketInstance) {
-            // Clean up existing socket
-            state.socketInstance.disconnect();
-        }
-        
-        const socket = io({
-            transports: ['websocket'],
-            upgrade: false,
-            reconnectionAttempts: 3
-        });
-        
-        state.socketInstance = socket;
-        
-        socket.on('connect', function() {
-            console.log('Socket connected for real-time updates');
-            socket.emit('join_customer_room', { otp: otp });
-        });
-        
-        // Listen for turn notifications
-        socket.on('customer_turn', function(turnData) {
-            if (turnData.otp === otp) {
-                // It's this customer's turn
-                showNotification("It's your turn!", 
-                    `Please proceed to Cashier #${turnData.cashier_number}`, 
-                    elements.statusLink ? elements.statusLink.href : null);
-            }
-        });
-        
-        socket.on('connect_error', function(error) {
-            console.log('Socket connection error:', error);
-            // Socket errors are non-critical, the user can still check status manually
-        });
-        
-        socket.on('disconnect', function() {
-            console.log('Socket disconnected');
-        });
-    }
-    
     // Function to show browser notification
     function showNotification(title, message, url) {
         // First try browser notifications
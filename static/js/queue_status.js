@@ -1,24 +1,23 @@
 document.addEventListener('DOMContentLoaded', function() {
     // Configuration
     const CONFIG = {
-        SOCKET_TIMEOUT: 10000,
-        RECONNECT_ATTEMPTS: 5,
-        RECONNECT_DELAY: 3000,
         STATUS_CHECK_INTERVAL: 10000,
-        NOTIFICATION_DISPLAY_TIME: 7000,
-        MIN_UPDATE_INTERVAL: 2000
+        LONG_POLL_SECONDS: 30,
+        MIN_POLL_INTERVAL: 1000,
+        NOTIFICATION_DISPLAY_TIME: 7000
     };
     
     // State management
     let state = {
         soundEnabled: localStorage.getItem('soundEnabled') !== 'false', // Default to true
         connected: false,
-        lastPositionUpdate: Date.now(),
         notificationHistory: [],
         currentRequest: null,
+        etag: null,
         updateTimer: null,
-        reconnectTimer: null,
-        reconnectAttempts: 0
+        polling: false,
+        pollRequest: null,
+        delays: null
     };
     
     // DOM Elements
@@ -26,6 +25,7 @@ document.addEventListener('DOMContentLoaded', function() {
         otp: document.getElementById('otp-value'),
         companyCode: document.getElementById('company-code'),
         customerStatus: document.getElementById('customer-status'),
+        cashierNumber: document.getElementById('cashier-number'),
         position: document.getElementById('position'),
         waitTime: document.getElementById('wait-time'),
         lastUpdateTime: document.getElementById('last-update-time'),
@@ -44,6 +44,10 @@ document.addEventListener('DOMContentLoaded', function() {
     const companyCode = elements.companyCode.value;
     const customerStatus = elements.customerStatus.value;
     
+    // Updates are pushed over a Server-Sent Events stream; while it is down, or
+    // where EventSource is missing, the page long-polls instead
+    const inQueue = customerStatus === 'waiting' || customerStatus === 'serving';
+    
     // Apply theme before any visual elements are created
     const savedTheme = localStorage.getItem('theme') || 'dark';
     document.body.setAttribute('data-theme', savedTheme);
@@ -52,15 +56,9 @@ document.addEventListener('DOMContentLoaded', function() {
     // Then initialize visual components
     initParticles();
     
-    // Set up socket connection
-    let socket;
-    initSocketConnection();
-    
-    // Initial status check with a short delay to let page render
-    setTimeout(checkStatus, 500);
-    
-    // Start periodic status check timer
-    state.updateTimer = setInterval(checkStatus, CONFIG.STATUS_CHECK_INTERVAL);
+    // The stream's first event (or the first poll) brings the current status
+    let stream;
+    initStatusStream();
     
     // Play sounds or show effects based on status
     if (customerStatus === 'served') {
@@ -82,135 +80,74 @@ document.addEventListener('DOMContentLoaded', function() {
     window.toggleTheme = toggleTheme;
     
     // Function implementations
-    function initSocketConnection() {
-        // Only create socket connection if needed
-        if (socket) return;
+    function initStatusStream() {
+        // Finished customers get no more updates
+        if (stream || !inQueue) return;
+        if (!window.EventSource) {
+            startPolling();
+            return;
+        }
         
-        socket = io({
-            transports: ['websocket'],
-            upgrade: false,
-            reconnectionAttempts: CONFIG.RECONNECT_ATTEMPTS,
-            timeout: CONFIG.SOCKET_TIMEOUT,
-            reconnection: true,
-            reconnectionDelay: CONFIG.RECONNECT_DELAY
-        });
+        stream = new EventSource(`/api/stream/${otp}`);
         
-        // Socket event listeners
-        socket.on('connect', function() {
+        stream.addEventListener('open', function() {
             state.connected = true;
-            state.reconnectAttempts = 0;
-            clearTimeout(state.reconnectTimer);
-            
-            console.log('Socket connected');
+            console.log('Status stream connected');
             addNotification('Connected to real-time updates');
-            
-            // Join rooms
-            socket.emit('join_customer_room', { otp: otp });
-            socket.emit('join_company_room', { company_code: companyCode });
+            stopPolling();
         });
         
-        socket.on('disconnect', function() {
-            state.connected = false;
-            console.log('Socket disconnected');
-            addNotification('Disconnected from updates. Will try reconnecting...');
-            
-            // Start custom reconnection strategy
-            if (!state.reconnectTimer) {
-                attemptReconnect();
+        // The browser reconnects by itself; until it does the page long-polls
+        stream.addEventListener('error', function() {
+            if (state.connected) {
+                state.connected = false;
+                console.log('Status stream disconnected');
+                addNotification('Disconnected from updates. Will try reconnecting...');
             }
+            startPolling();
         });
         
-        socket.on('customer_turn', function(data) {
-            if (data.otp === otp) {
-                addNotification('It\'s your turn! Proceed to Cashier #' + data.cashier_number);
-                if (state.soundEnabled) {
-                    playSound();
-                }
-                // Reload the page to update status
-                window.location.reload();
-            }
-        });
-        
-        socket.on('customer_removed', function(data) {
-            if (data.otp === otp) {
-                addNotification('You\'ve been removed from the queue');
-                // Reload the page to update status
-                window.location.reload();
-            }
-        });
-        
-        socket.on('customer_delayed', function(data) {
-            if (data.otp === otp) {
+        // Sent whenever status, position or wait estimate changes
+        stream.addEventListener('status', function(event) {
+            const data = JSON.parse(event.data);
+            if (state.delays !== null && data.delays > state.delays) {
                 addNotification('Your service has been delayed. You have been moved back in the queue.');
-                setTimeout(checkStatus, 500);
             }
-        });
-        
-        socket.on('connect_error', function(error) {
-            console.log('Connection error, falling back to polling:', error);
-            addNotification('Connection issue. Using periodic updates instead');
+            state.delays = data.delays;
             
-            if (state.reconnectAttempts < CONFIG.RECONNECT_ATTEMPTS) {
-                attemptReconnect();
-            }
-        });
-
-        socket.on('queue_updated', function(data) {
-            console.log('Queue updated event received:', data);
-            addNotification('Queue positions have been updated. Refreshing your status...');
+            updateStatusUI(data);
+            updateStoredQueueData(data);
             
-            // Debounce updates
-            const now = Date.now();
-            if (now - state.lastPositionUpdate > CONFIG.MIN_UPDATE_INTERVAL) {
-                state.lastPositionUpdate = now;
-                checkStatus();
-            } else {
-                console.log('Throttling position update check');
+            // The server ends the stream once the customer is served or removed
+            if (data.status !== 'waiting' && data.status !== 'serving') {
+                stream.close();
             }
         });
     }
     
-    function attemptReconnect() {
-        state.reconnectAttempts++;
-        clearTimeout(state.reconnectTimer);
-        
-        // Exponential backoff for reconnection
-        const delay = Math.min(30000, CONFIG.RECONNECT_DELAY * Math.pow(1.5, state.reconnectAttempts - 1));
-        
-        console.log(`Attempt ${state.reconnectAttempts} to reconnect in ${delay}ms`);
-        
-        state.reconnectTimer = setTimeout(() => {
-            if (!state.connected && socket) {
-                console.log('Attempting to reconnect socket...');
-                socket.connect();
-            }
-        }, delay);
-    }
-    
-    function checkStatus() {
-        addNotification('Checking for updates...');
-        
-        // Cancel any in-flight request to prevent race conditions
-        if (state.currentRequest) {
-            state.currentRequest.abort();
+    function requestStatus(wait, signal) {
+        // Sends the last ETag so an unchanged status costs a bodiless 304;
+        // with wait > 0 the server holds the request until the status changes
+        const headers = { 'Cache-Control': 'no-cache' };
+        if (state.etag) {
+            headers['If-None-Match'] = state.etag;
         }
         
-        const controller = new AbortController();
-        state.currentRequest = controller;
-        
-        fetch(`/api/check_status/${otp}`, {
-            signal: controller.signal,
-            headers: { 'Cache-Control': 'no-cache' }
-        })
+        return fetch(`/api/check_status/${otp}` + (wait ? `?wait=${wait}` : ''), { signal: signal, headers: headers })
         .then(response => {
+            if (response.status === 304) {
+                return null;
+            }
             if (!response.ok) {
                 throw new Error(`Network response not ok: ${response.status}`);
             }
+            state.etag = response.headers.get('ETag');
             return response.json();
         })
         .then(data => {
-            state.currentRequest = null;
-            
+            if (!data) {
+                return;
+            }
             if (data.error) {
                 throw new Error(data.error);
             }
@@ -222,6 +159,57 @@ document.addEventListener('DOMContentLoaded', function() {
             
             // Store the latest queue data in localStorage to maintain state
             updateStoredQueueData(data);
+        });
+    }
+    
+    function startPolling() {
+        if (state.polling || !inQueue) return;
+        state.polling = true;
+        pollStatus();
+    }
+    
+    function stopPolling() {
+        state.polling = false;
+        clearTimeout(state.updateTimer);
+        if (state.pollRequest) {
+            state.pollRequest.abort();
+            state.pollRequest = null;
+        }
+    }
+    
+    function pollStatus() {
+        const started = Date.now();
+        const controller = new AbortController();
+        state.pollRequest = controller;
+        
+        requestStatus(CONFIG.LONG_POLL_SECONDS, controller.signal)
+        .then(() => {
+            if (!state.polling) return;
+            // Never poll more than once per MIN_POLL_INTERVAL
+            const delay = Math.max(0, CONFIG.MIN_POLL_INTERVAL - (Date.now() - started));
+            state.updateTimer = setTimeout(pollStatus, delay);
+        })
+        .catch(error => {
+            if (error.name === 'AbortError' || !state.polling) return;
+            console.error('Error polling status:', error);
+            state.updateTimer = setTimeout(pollStatus, CONFIG.STATUS_CHECK_INTERVAL);
+        });
+    }
+    
+    function checkStatus() {
+        addNotification('Checking for updates...');
+        
+        // Cancel any in-flight request to prevent race conditions
+        if (state.currentRequest) {
+            state.currentRequest.abort();
+        }
+        
+        const controller = new AbortController();
+        state.currentRequest = controller;
+        
+        requestStatus(0, controller.signal)
+        .then(() => {
+            state.currentRequest = null;
         })
         .catch(error => {
             state.currentRequest = null;
@@ -234,11 +222,6 @@ document.addEventListener('DOMContentLoaded', function() {
             
             console.error('Error checking status:', error);
             addNotification('Error checking for updates. Will retry...');
-            
-            // Try reconnecting socket if we had an error
-            if (!state.connected && socket) {
-                attemptReconnect();
-            }
         });
     }
     
@@ -269,7 +252,10 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         
         // Reload page if status has changed
-        if (data.status !== customerStatus) {
+        if (elements.cashierNumber && data.cashier_number != elements.cashierNumber.value) {
+            addNotification(`You have been moved to Cashier #${data.cashier_number}. Refreshing page...`);
+            setTimeout(() => window.location.reload(), 1500);
+        } else if (data.status !== customerStatus) {
             addNotification(`Status changed to: ${data.status}. Refreshing page...`);
             setTimeout(() => window.location.reload(), 1500);
         }